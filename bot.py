@@ -8,12 +8,14 @@ import re
 import time
 import signal
 import tempfile
+import hashlib
 from datetime import datetime
 from typing import Dict, Set, Optional, List
 from asyncio import Lock
-from contextlib import contextmanager, asynccontextmanager
+from contextlib import contextmanager, asynccontextmanager, nullcontext
 from pathlib import Path
 from collections import OrderedDict
+from functools import lru_cache
 from queue import Queue
 from threading import Lock as ThreadLock
 
@@ -228,6 +230,13 @@ def deserialize_entities(entities_data):
 
     return entities
 
+def with_file_name(attributes: list, file_name: str) -> list:
+    """Copy of attributes with the document file name replaced (rename without touching any file)."""
+    renamed = [attr for attr in attributes if not isinstance(attr, types.DocumentAttributeFilename)]
+    renamed.append(types.DocumentAttributeFilename(file_name))
+    return renamed
+
+
 def extract_media_attributes(msg):
     """
     Extract all media attributes from original message to preserve format.
@@ -478,13 +487,16 @@ DEFAULT_MODIFY = {
 TELETHON_AVAILABLE = True
 try:
     from telethon import TelegramClient, events, errors
+    from telethon import utils as tl_utils
+    from telethon.network import MTProtoSender
+    from telethon.tl.alltlobjects import LAYER
     from telethon.tl.types import (
         User, Channel, Chat, PeerChannel,
         MessageEntityBold, MessageEntityItalic, MessageEntityCode,
         MessageEntityPre, MessageEntityTextUrl, MessageEntityStrike,
         MessageEntityUnderline, MessageEntitySpoiler
     )
-    from telethon.tl import types
+    from telethon.tl import types, functions
 except ImportError:
     TELETHON_AVAILABLE = False
     class _PlaceholderErrors:
@@ -496,11 +508,16 @@ except ImportError:
         class PhoneNumberBannedError(Exception): pass
         class ChannelPrivateError(Exception): pass
         class ChatWriteForbiddenError(Exception): pass
+        class RPCError(Exception): pass
     errors = _PlaceholderErrors
     TelegramClient = None
     events = None
     PeerChannel = None
     types = None
+    functions = None
+    tl_utils = None
+    MTProtoSender = None
+    LAYER = None
 
 TELEGRAM_AVAILABLE = True
 try:
@@ -624,6 +641,29 @@ class Config:
     - ADMIN_USER_ID        : (Optional) Admin user ID for special permissions
     - SESSION_DIR          : (Optional) Directory for session files
     - DATABASE_FILE        : (Optional) SQLite database file path
+    - FFMPEG_TIMEOUT       : (Optional) Seconds before a watermark FFmpeg run is killed
+    - TRANSFORM_WORKERS    : (Optional) Concurrent watermark jobs (FFmpeg/Pillow)
+    - TRANSFORM_QUEUE_SIZE : (Optional) Watermark jobs allowed to wait for a worker
+    - TRANSFORM_JOB_TIMEOUT: (Optional) Seconds a watermark job may run once started
+    - WATERMARK_OVERLAY_CACHE_MB: (Optional) Memory/disk budget for pre-rendered watermarks
+    - MEDIA_STREAMING      : (Optional) Stream download -> FFmpeg/upload without temp files (1/0)
+    - STREAM_BUFFER_CHUNKS : (Optional) Downloaded chunks buffered ahead of a streaming upload
+    - MEMORY_MEDIA_MAX_KB  : (Optional) Media up to this size is copied through memory, not a temp file (0 = off)
+    - PARALLEL_TRANSFER_MIN_MB: (Optional) Documents from this size are transferred over several connections
+    - TRANSFER_CONNECTIONS : (Optional) Default connections per parallel transfer (per-account override: /transfer)
+    - TRANSFER_PART_KB     : (Optional) Default part size of a parallel transfer, 32-1024 KB
+    - SPOOL_DIR            : (Optional) Directory for media work files (emptied at startup)
+    - SPOOL_QUOTA_MB       : (Optional) Disk budget for media work files; jobs wait for space
+    - SPOOL_WAIT_TIMEOUT   : (Optional) Seconds a media job may wait for spool space
+    - MEDIA_CACHE_DIR      : (Optional) Directory of the media cache (keyed by Telegram media ID)
+    - MEDIA_CACHE_MB       : (Optional) Disk budget of the media cache (0 = off)
+    - MEDIA_CACHE_MAX_AGE_HOURS: (Optional) Cached media unused this long is evicted
+    - FANOUT_CONCURRENCY   : (Optional) Destinations an account delivers to at the same time
+    - ACCOUNT_SEND_RATE    : (Optional) Sends per second an account may sustain (token bucket)
+    - ACCOUNT_SEND_BURST   : (Optional) Sends an account may make back to back before pacing
+    - CHAT_SEND_RATE       : (Optional) Sends per second to one private chat or channel
+    - GROUP_SENDS_PER_MINUTE : (Optional) Sends per minute to one group
+    - FORWARD_BATCH_WINDOW : (Optional) Seconds to collect forwards to a destination into one call (0 = off)
     """
     # Required settings
     API_ID: int = int(os.getenv('TELEGRAM_API_ID', '0'))
@@ -638,6 +678,31 @@ class Config:
     # Bot settings
     MAX_RULES_PER_USER: int = int(os.getenv('MAX_RULES_PER_USER', '50'))
     MAX_ACCOUNTS_PER_USER: int = int(os.getenv('MAX_ACCOUNTS_PER_USER', '10'))
+
+    # Media processing
+    FFMPEG_TIMEOUT: int = int(os.getenv('FFMPEG_TIMEOUT', '60'))
+    TRANSFORM_WORKERS: int = int(os.getenv('TRANSFORM_WORKERS', '2'))
+    TRANSFORM_QUEUE_SIZE: int = int(os.getenv('TRANSFORM_QUEUE_SIZE', '100'))
+    TRANSFORM_JOB_TIMEOUT: int = int(os.getenv('TRANSFORM_JOB_TIMEOUT', '120'))
+    WATERMARK_OVERLAY_CACHE_MB: int = int(os.getenv('WATERMARK_OVERLAY_CACHE_MB', '64'))
+    MEDIA_STREAMING: bool = os.getenv('MEDIA_STREAMING', '1').lower() in ('1', 'true', 'yes')
+    STREAM_BUFFER_CHUNKS: int = int(os.getenv('STREAM_BUFFER_CHUNKS', '8'))
+    MEMORY_MEDIA_MAX_KB: int = int(os.getenv('MEMORY_MEDIA_MAX_KB', '1024'))
+    PARALLEL_TRANSFER_MIN_MB: int = int(os.getenv('PARALLEL_TRANSFER_MIN_MB', '20'))
+    TRANSFER_CONNECTIONS: int = int(os.getenv('TRANSFER_CONNECTIONS', '4'))
+    TRANSFER_PART_KB: int = int(os.getenv('TRANSFER_PART_KB', '512'))
+    SPOOL_DIR: str = os.getenv('SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'autoforward_spool'))
+    SPOOL_QUOTA_MB: int = int(os.getenv('SPOOL_QUOTA_MB', '4096'))
+    SPOOL_WAIT_TIMEOUT: int = int(os.getenv('SPOOL_WAIT_TIMEOUT', '600'))
+    MEDIA_CACHE_DIR: str = os.getenv('MEDIA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'autoforward_media_cache'))
+    MEDIA_CACHE_MB: int = int(os.getenv('MEDIA_CACHE_MB', '2048'))
+    MEDIA_CACHE_MAX_AGE_HOURS: float = float(os.getenv('MEDIA_CACHE_MAX_AGE_HOURS', '24'))
+    FANOUT_CONCURRENCY: int = int(os.getenv('FANOUT_CONCURRENCY', '4'))
+    ACCOUNT_SEND_RATE: float = float(os.getenv('ACCOUNT_SEND_RATE', '1.0'))
+    ACCOUNT_SEND_BURST: int = int(os.getenv('ACCOUNT_SEND_BURST', '5'))
+    CHAT_SEND_RATE: float = float(os.getenv('CHAT_SEND_RATE', '1.0'))
+    GROUP_SENDS_PER_MINUTE: int = int(os.getenv('GROUP_SENDS_PER_MINUTE', '20'))
+    FORWARD_BATCH_WINDOW: float = float(os.getenv('FORWARD_BATCH_WINDOW', '0.5'))
     
     @classmethod
     def validate(cls) -> bool:
@@ -691,6 +756,29 @@ class Config:
             cls.DATABASE_FILE = os.getenv('DATABASE_FILE', 'autoforward.db')
             cls.MAX_RULES_PER_USER = int(os.getenv('MAX_RULES_PER_USER', '50'))
             cls.MAX_ACCOUNTS_PER_USER = int(os.getenv('MAX_ACCOUNTS_PER_USER', '10'))
+            cls.FFMPEG_TIMEOUT = int(os.getenv('FFMPEG_TIMEOUT', '60'))
+            cls.TRANSFORM_WORKERS = int(os.getenv('TRANSFORM_WORKERS', '2'))
+            cls.TRANSFORM_QUEUE_SIZE = int(os.getenv('TRANSFORM_QUEUE_SIZE', '100'))
+            cls.TRANSFORM_JOB_TIMEOUT = int(os.getenv('TRANSFORM_JOB_TIMEOUT', '120'))
+            cls.WATERMARK_OVERLAY_CACHE_MB = int(os.getenv('WATERMARK_OVERLAY_CACHE_MB', '64'))
+            cls.MEDIA_STREAMING = os.getenv('MEDIA_STREAMING', '1').lower() in ('1', 'true', 'yes')
+            cls.STREAM_BUFFER_CHUNKS = int(os.getenv('STREAM_BUFFER_CHUNKS', '8'))
+            cls.MEMORY_MEDIA_MAX_KB = int(os.getenv('MEMORY_MEDIA_MAX_KB', '1024'))
+            cls.PARALLEL_TRANSFER_MIN_MB = int(os.getenv('PARALLEL_TRANSFER_MIN_MB', '20'))
+            cls.TRANSFER_CONNECTIONS = int(os.getenv('TRANSFER_CONNECTIONS', '4'))
+            cls.TRANSFER_PART_KB = int(os.getenv('TRANSFER_PART_KB', '512'))
+            cls.SPOOL_DIR = os.getenv('SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'autoforward_spool'))
+            cls.SPOOL_QUOTA_MB = int(os.getenv('SPOOL_QUOTA_MB', '4096'))
+            cls.SPOOL_WAIT_TIMEOUT = int(os.getenv('SPOOL_WAIT_TIMEOUT', '600'))
+            cls.MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'autoforward_media_cache'))
+            cls.MEDIA_CACHE_MB = int(os.getenv('MEDIA_CACHE_MB', '2048'))
+            cls.MEDIA_CACHE_MAX_AGE_HOURS = float(os.getenv('MEDIA_CACHE_MAX_AGE_HOURS', '24'))
+            cls.FANOUT_CONCURRENCY = int(os.getenv('FANOUT_CONCURRENCY', '4'))
+            cls.ACCOUNT_SEND_RATE = float(os.getenv('ACCOUNT_SEND_RATE', '1.0'))
+            cls.ACCOUNT_SEND_BURST = int(os.getenv('ACCOUNT_SEND_BURST', '5'))
+            cls.CHAT_SEND_RATE = float(os.getenv('CHAT_SEND_RATE', '1.0'))
+            cls.GROUP_SENDS_PER_MINUTE = int(os.getenv('GROUP_SENDS_PER_MINUTE', '20'))
+            cls.FORWARD_BATCH_WINDOW = float(os.getenv('FORWARD_BATCH_WINDOW', '0.5'))
             log.info("✅ Loaded .env file")
         except ImportError:
             log.debug("python-dotenv not installed, skipping .env file")
@@ -949,12 +1037,15 @@ class TokenBucketRateLimiter:
         self.capacity = capacity
         self.tokens = capacity
         self.last_update = time.time()
+        self.blocked_until = 0.0
         self.lock = asyncio.Lock()
 
     async def acquire(self, tokens: int = 1) -> bool:
         """Try to acquire tokens."""
         async with self.lock:
             now = time.time()
+            if now < self.blocked_until:
+                return False
             elapsed = now - self.last_update
 
             self.tokens = min(
@@ -968,6 +1059,85 @@ class TokenBucketRateLimiter:
                 return True
             return False
 
+    async def wait(self, tokens: int = 1) -> float:
+        """Wait until tokens can be acquired and take them; returns seconds waited."""
+        waited = 0.0
+        while not await self.acquire(tokens):
+            delay = max(
+                self.blocked_until - time.time(),
+                (tokens - self.tokens) / self.rate,
+                0.01
+            )
+            await asyncio.sleep(delay)
+            waited += delay
+        return waited
+
+    def block(self, seconds: float):
+        """Hand out nothing for `seconds` (e.g. after a FloodWait), then refill from empty."""
+        self.blocked_until = max(self.blocked_until, time.time() + seconds)
+        self.tokens = 0
+        self.last_update = self.blocked_until
+
+
+class SendPacer:
+    """
+    Paces one account's sends before Telegram has to: a token bucket for the
+    account plus one per destination chat (groups allow fewer messages per
+    minute than private chats and channels).
+
+    A FloodWait blocks its chat for the requested time and halves the account
+    rate; the rate doubles back towards the configured one after every
+    FLOOD_COOLDOWN seconds without another.
+    """
+
+    FLOOD_COOLDOWN = 600
+
+    def __init__(self, rate: float, burst: int, chat_rate: float, group_per_minute: int):
+        self.base_rate = max(rate, 0.01)
+        self.account = TokenBucketRateLimiter(self.base_rate, max(1, burst))
+        self.chat_rate = max(chat_rate, 0.01)
+        self.group_rate = max(group_per_minute, 1) / 60.0
+        self.chats: Dict[int, TokenBucketRateLimiter] = {}
+        self.last_flood = 0.0
+        self.floods = 0
+        self.waited = 0.0
+
+    def _chat_bucket(self, entity) -> TokenBucketRateLimiter:
+        peer_id = getattr(entity, 'id', 0)
+        bucket = self.chats.get(peer_id)
+        if bucket is None:
+            is_group = isinstance(entity, types.Chat) or getattr(entity, 'megagroup', False)
+            bucket = TokenBucketRateLimiter(self.group_rate, 3) if is_group \
+                else TokenBucketRateLimiter(self.chat_rate, 3)
+            self.chats[peer_id] = bucket
+        return bucket
+
+    async def wait(self, entity):
+        """
+        Wait for a send slot to `entity`: the chat's bucket first, so a slow
+        group doesn't sit on account tokens other destinations could use.
+        """
+        if self.account.rate < self.base_rate and time.time() - self.last_flood > self.FLOOD_COOLDOWN:
+            self.account.rate = min(self.base_rate, self.account.rate * 2)
+            self.last_flood = time.time()  # next step after another quiet cooldown
+        self.waited += await self._chat_bucket(entity).wait()
+        self.waited += await self.account.wait()
+
+    def flood(self, entity, seconds: float):
+        """Learn from a FloodWait on a send to `entity`."""
+        self.floods += 1
+        self.last_flood = time.time()
+        self._chat_bucket(entity).block(seconds)
+        self.account.rate = max(self.base_rate / 8, self.account.rate / 2)
+
+    def stats(self) -> dict:
+        return {
+            'rate': self.account.rate,
+            'base_rate': self.base_rate,
+            'floods': self.floods,
+            'waited': self.waited,
+        }
+
 
 class UserRateLimiter:
     """Per-user rate limiting."""
@@ -1055,6 +1225,32 @@ def parse_multi_ids(text: str) -> List[str]:
             result.append(p)
     return result
 
+def normalize_source(source: str) -> str:
+    """Canonical stored form of a source: trimmed, lowercase @username or plain integer text."""
+    source = source.strip()
+    if source.startswith('@'):
+        return source.lower()
+    try:
+        return str(int(source))
+    except ValueError:
+        return source
+
+def bare_peer_id(peer_id: int) -> int:
+    """Strip the -100 channel marker and sign so every ID form of a chat compares equal."""
+    if peer_id <= -1000000000000:
+        return -peer_id - 1000000000000
+    return abs(peer_id)
+
+def source_match_keys(source: str) -> tuple:
+    """Returns (bare_peer_id, lowercase_username) for a source; one of them is None."""
+    source = normalize_source(source)
+    if source.startswith('@'):
+        return None, source[1:] or None
+    try:
+        return bare_peer_id(int(source)), None
+    except ValueError:
+        return None, None
+
 def format_id_list(ids: List[str], max_show: int = 3) -> str:
     """Format ID list for display."""
     if len(ids) <= max_show:
@@ -1062,24 +1258,150 @@ def format_id_list(ids: List[str], max_show: int = 3) -> str:
     return ', '.join(f'`{i}`' for i in ids[:max_show]) + f' +{len(ids)-max_show} more'
 
 # ==================== WATERMARK PROCESSING ====================
-def apply_watermark_with_ffmpeg(input_path: str, output_path: str, watermark_config: dict, is_video: bool = False) -> bool:
+class FFmpegResult:
+    """Outcome of one FFmpeg run: returncode (None if killed) and the tail of stderr."""
+
+    __slots__ = ('returncode', 'stderr', 'timed_out')
+
+    def __init__(self, returncode: Optional[int], stderr: str, timed_out: bool = False):
+        self.returncode = returncode
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+
+async def run_ffmpeg(cmd: List[str], timeout: float = None, stderr_lines: int = 50,
+                     stdin_chunks=None) -> FFmpegResult:
+    """
+    Run FFmpeg without blocking the event loop.
+
+    stderr is streamed line by line (logged at debug level, last lines kept for
+    the result). On timeout or task cancellation the process is killed and
+    reaped, so no orphaned FFmpeg keeps running.
+
+    stdin_chunks: optional async iterable of bytes fed to FFmpeg's stdin
+    (use 'pipe:0' as the input); pipe backpressure bounds the buffering.
+    The timeout then counts from the last chunk fed instead of from the
+    start, so a slow download isn't charged to the encode: FFmpeg is killed
+    when the input stalls, or `timeout` seconds after the input ended.
+
+    Raises:
+        FileNotFoundError: FFmpeg is not installed
+        Exception: whatever stdin_chunks raised (the output is incomplete)
+    """
+    from collections import deque
+
+    if timeout is None:
+        timeout = Config.FFMPEG_TIMEOUT
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if stdin_chunks is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    tail = deque(maxlen=stderr_lines)
+    feed_error = []
+    last_input = [time.monotonic()]
+
+    async def feed_stdin():
+        try:
+            async for chunk in stdin_chunks:
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+                last_input[0] = time.monotonic()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # FFmpeg stopped reading; its exit code tells why
+        except Exception as e:
+            feed_error.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+
+    async def pump_stderr():
+        while True:
+            line = await proc.stderr.readline()
+            if not line:
+                break
+            text = line.decode('utf-8', errors='replace').rstrip()
+            tail.append(text)
+            log.debug(f"🎬 ffmpeg[{proc.pid}]: {text}")
+        return await proc.wait()
+
+    async def communicate():
+        if stdin_chunks is None:
+            return await pump_stderr()
+        feeder = asyncio.create_task(feed_stdin())
+        try:
+            return await pump_stderr()
+        finally:
+            if not feeder.done():
+                feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+
+    async def kill():
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    async def supervise():
+        task = asyncio.ensure_future(communicate())
+        try:
+            while True:
+                remaining = last_input[0] + timeout - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                try:
+                    return await asyncio.wait_for(asyncio.shield(task), remaining)
+                except asyncio.TimeoutError:
+                    continue  # re-check: input may have arrived meanwhile
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    try:
+        await supervise()
+    except asyncio.TimeoutError:
+        await kill()
+        return FFmpegResult(None, '\n'.join(tail), timed_out=True)
+    except asyncio.CancelledError:
+        await asyncio.shield(kill())
+        raise
+    if feed_error:
+        raise feed_error[0]
+    return FFmpegResult(proc.returncode, '\n'.join(tail))
+
+
+async def apply_watermark_with_ffmpeg(input_path: str, output_path: str, watermark_config: dict,
+                                     is_video: bool = False, resolution: tuple = None,
+                                     input_chunks=None) -> bool:
     """
     Apply watermark to image or video using FFmpeg (preferred method).
+    Runs as an asyncio subprocess; cancelling the caller kills FFmpeg.
 
     Args:
         input_path: Path to input file (image or video)
         output_path: Path to save watermarked file
         watermark_config: Dictionary with watermark settings
         is_video: True if input is video, False if image
+        resolution: (width, height) of the media if known; enables the
+            pre-rendered overlay instead of drawtext/logo filters
+        input_chunks: async iterable with the input bytes (streamed to stdin
+            instead of reading input_path); single use, so no filter retry
 
     Returns:
         True if successful, False otherwise
     """
     try:
-        import subprocess
         import os
 
         media_type = "video" if is_video else "image"
+        if input_chunks is not None:
+            input_path = 'pipe:0'
         log.info(f"🎬 FFmpeg Watermark: Processing {media_type}: {input_path}")
 
         watermark_type = watermark_config.get('watermark_type', 'text')
@@ -1103,6 +1425,39 @@ def apply_watermark_with_ffmpeg(input_path: str, output_path: str, watermark_con
         }
         pos_string = position_map.get(position, 'x=W-w-10:y=H-h-10')
 
+        # Cached full-frame overlay: FFmpeg only scales it to the frame and blends
+        overlay_path = None
+        if resolution and all(resolution):
+            try:
+                overlay_path = await asyncio.to_thread(watermark_overlays.get_path, watermark_config, *resolution)
+            except ImportError:
+                pass  # Pillow not installed - use FFmpeg filters
+            except Exception as e:
+                log.warning(f"⚠️ Watermark overlay render failed: {e}")
+        if overlay_path:
+            cmd = [
+                'ffmpeg', '-i', input_path,
+                '-i', overlay_path,
+                '-filter_complex', '[1:v][0:v]scale2ref[wm][base];[base][wm]overlay=0:0',
+            ]
+            if is_video:
+                cmd += ['-codec:a', 'copy']
+            else:
+                cmd += ['-frames:v', '1', '-update', '1']
+            cmd += ['-y', output_path]
+            log.info(f"🎬 FFmpeg Watermark: Using cached overlay {overlay_path}")
+            result = await run_ffmpeg(cmd, stdin_chunks=input_chunks)
+            if result.returncode == 0:
+                log.info(f"🎬 FFmpeg Watermark: ✅ {media_type.capitalize()} watermark completed successfully")
+                return True
+            if result.timed_out:
+                log.error(f"❌ FFmpeg timeout ({Config.FFMPEG_TIMEOUT}s exceeded): {result.stderr[-500:]}")
+                return False
+            if input_chunks is not None:
+                log.error(f"❌ FFmpeg overlay failed on streamed input (returncode={result.returncode}): {result.stderr[-500:]}")
+                return False
+            log.warning(f"⚠️ FFmpeg overlay failed (returncode={result.returncode}), retrying with filters: {result.stderr[-500:]}")
+
         if watermark_type == 'text':
             text = watermark_config.get('watermark_text', '')
             if not text:
@@ -1182,8 +1537,11 @@ def apply_watermark_with_ffmpeg(input_path: str, output_path: str, watermark_con
         # Run FFmpeg
         log.info(f"🎬 FFmpeg Watermark: Running command")
         log.info(f"🎬 FFmpeg Watermark: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        result = await run_ffmpeg(cmd, stdin_chunks=input_chunks)
 
+        if result.timed_out:
+            log.error(f"❌ FFmpeg timeout ({Config.FFMPEG_TIMEOUT}s exceeded): {result.stderr[-500:]}")
+            return False
         if result.returncode == 0:
             log.info(f"🎬 FFmpeg Watermark: ✅ {media_type.capitalize()} watermark completed successfully")
             return True
@@ -1194,9 +1552,6 @@ def apply_watermark_with_ffmpeg(input_path: str, output_path: str, watermark_con
     except FileNotFoundError:
         log.warning("⚠️ FFmpeg not installed. Will try Pillow for images.")
         return False
-    except subprocess.TimeoutExpired:
-        log.error("❌ FFmpeg timeout (60s exceeded)")
-        return False
     except Exception as e:
         log.error(f"❌ Failed to apply FFmpeg watermark: {e}")
         import traceback
@@ -1204,173 +1559,231 @@ def apply_watermark_with_ffmpeg(input_path: str, output_path: str, watermark_con
         return False
 
 
-def apply_watermark_to_image(input_path: str, output_path: str, watermark_config: dict) -> bool:
+WATERMARK_FONT_PATHS = (
+    "arial.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/System/Library/Fonts/Helvetica.ttc",  # macOS
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf"
+)
+
+# FreeType faces are shared between transform threads; serialize text rendering
+_watermark_font_lock = ThreadLock()
+
+
+@lru_cache(maxsize=1)
+def find_watermark_font_path() -> Optional[str]:
+    """First usable TrueType font from WATERMARK_FONT_PATHS (probed once)."""
+    from PIL import ImageFont
+
+    for font_path in WATERMARK_FONT_PATHS:
+        try:
+            ImageFont.truetype(font_path, 10)
+            return font_path
+        except (OSError, IOError):
+            # Font file not found or cannot be read
+            continue
+    return None
+
+
+@lru_cache(maxsize=64)
+def load_watermark_font(font_size: int):
+    """Font object for a watermark size, loaded once per size."""
+    from PIL import ImageFont
+
+    font_path = find_watermark_font_path()
+    if font_path is None:
+        # If no TrueType font found, use default (but it won't resize well)
+        log.warning("No TrueType font found, using default font (watermark may be small)")
+        return ImageFont.load_default()
+    return ImageFont.truetype(font_path, font_size)
+
+
+@lru_cache(maxsize=32)
+def load_watermark_logo(logo_path: str, mtime: float, opacity: int):
+    """Decoded RGBA logo with opacity already multiplied into alpha (cached per file version)."""
+    from PIL import Image
+
+    logo = Image.open(logo_path).convert('RGBA')
+    log.info(f"📸 Watermark: Logo loaded, size: {logo.size[0]}x{logo.size[1]}")
+    if opacity < 255:
+        alpha = logo.getchannel('A').point(lambda p: int(p * opacity / 255))
+        logo.putalpha(alpha)
+    return logo
+
+
+def render_watermark_overlay(watermark_config: dict, width: int, height: int, ffmpeg_geometry: bool = False):
     """
-    Apply watermark to an image using Pillow (PIL).
+    Render the watermark as a transparent full-frame RGBA layer with Pillow.
 
     Args:
-        input_path: Path to input image
-        output_path: Path to save watermarked image
         watermark_config: Dictionary with watermark settings
+        width, height: Frame size the layer is drawn for
+        ffmpeg_geometry: Size it like the FFmpeg filters do (text at a share of
+            the frame height, logo at a share of its own width, no rotation)
+            instead of the Pillow image path (share of the shorter side /
+            frame width, rotated)
 
     Returns:
-        True if successful, False otherwise
+        PIL.Image in RGBA mode, or None if the watermark can't be rendered
     """
-    try:
-        from PIL import Image, ImageDraw, ImageFont
-        import os
-
-        log.info(f"📸 Watermark: Loading image from {input_path}")
-
-        # Load the main image
-        img = Image.open(input_path).convert('RGBA')
-        width, height = img.size
-        log.info(f"📸 Watermark: Image size {width}x{height}")
-
-        # Create watermark layer
-        watermark_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(watermark_layer)
+    from PIL import Image, ImageDraw, ImageFont
+    import os
 
-        watermark_type = watermark_config.get('watermark_type', 'text')
-        position = watermark_config.get('watermark_position', 'bottom-right')
-        opacity = int(watermark_config.get('watermark_opacity', 50) * 2.55)  # Convert 0-100 to 0-255
-        rotation = watermark_config.get('watermark_rotation', 0)
-        size_percent = watermark_config.get('watermark_size', 10)
+    # Create watermark layer
+    watermark_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(watermark_layer)
 
-        log.info(f"📸 Watermark: type={watermark_type}, position={position}, opacity={opacity}/255, rotation={rotation}°, size={size_percent}%")
+    watermark_type = watermark_config.get('watermark_type', 'text')
+    position = watermark_config.get('watermark_position', 'bottom-right')
+    opacity = int(watermark_config.get('watermark_opacity', 50) * 2.55)  # Convert 0-100 to 0-255
+    rotation = watermark_config.get('watermark_rotation', 0)
+    size_percent = watermark_config.get('watermark_size', 10)
 
-        if watermark_type == 'text':
-            # Text watermark
-            text = watermark_config.get('watermark_text', '')
-            if not text:
-                log.error("📸 Watermark FAILED: No watermark text provided")
-                return False
+    log.info(f"📸 Watermark: type={watermark_type}, position={position}, opacity={opacity}/255, rotation={rotation}°, size={size_percent}%")
 
-            log.info(f"📸 Watermark: Adding text '{text[:30]}...'")
+    if watermark_type == 'text':
+        # Text watermark
+        text = watermark_config.get('watermark_text', '')
+        if not text:
+            log.error("📸 Watermark FAILED: No watermark text provided")
+            return None
 
+        log.info(f"📸 Watermark: Adding text '{text[:30]}...'")
 
-            color_name = watermark_config.get('watermark_text_color', 'white')
-            color_map = {
-                'white': (255, 255, 255, opacity),
-                'black': (0, 0, 0, opacity),
-                'blue': (0, 0, 255, opacity),
-                'red': (255, 0, 0, opacity)
-            }
-            color = color_map.get(color_name, (255, 255, 255, opacity))
+        color_name = watermark_config.get('watermark_text_color', 'white')
+        color_map = {
+            'white': (255, 255, 255, opacity),
+            'black': (0, 0, 0, opacity),
+            'blue': (0, 0, 255, opacity),
+            'red': (255, 0, 0, opacity)
+        }
+        color = color_map.get(color_name, (255, 255, 255, opacity))
 
-            # Calculate font size based on image size and size_percent
+        # Calculate font size based on image size and size_percent
+        if ffmpeg_geometry:
+            font_size = max(1, int(height * size_percent / 100))  # drawtext fontsize=h*size/100
+        else:
             font_size = int(min(width, height) * size_percent / 100)
             if font_size < 10:  # Minimum font size
                 font_size = 10
 
-            try:
-                # Try common font paths
-                font = None
-                font_paths = [
-                    "arial.ttf",
-                    "C:\\Windows\\Fonts\\arial.ttf",
-                    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                    "/System/Library/Fonts/Helvetica.ttc",  # macOS
-                    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf"
-                ]
-
-                for font_path in font_paths:
-                    try:
-                        font = ImageFont.truetype(font_path, font_size)
-                        break
-                    except (OSError, IOError) as e:
-                        # Font file not found or cannot be read
-                        continue
-
-                # If no TrueType font found, use default (but it won't resize well)
-                if font is None:
-                    log.warning("No TrueType font found, using default font (watermark may be small)")
-                    font = ImageFont.load_default()
-            except Exception as e:
-                log.error(f"Font loading error: {e}")
-                font = ImageFont.load_default()
+        try:
+            font = load_watermark_font(font_size)
+        except Exception as e:
+            log.error(f"Font loading error: {e}")
+            font = ImageFont.load_default()
 
-            # Get text bounding box
+        # Get text bounding box
+        with _watermark_font_lock:
             bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-
-            # Calculate position
-            if position == 'top-left':
-                x, y = 10, 10
-            elif position == 'top':
-                x, y = (width - text_width) // 2, 10
-            elif position == 'top-right':
-                x, y = width - text_width - 10, 10
-            elif position == 'left':
-                x, y = 10, (height - text_height) // 2
-            elif position == 'center':
-                x, y = (width - text_width) // 2, (height - text_height) // 2
-            elif position == 'right':
-                x, y = width - text_width - 10, (height - text_height) // 2
-            elif position == 'bottom-left':
-                x, y = 10, height - text_height - 10
-            elif position == 'bottom':
-                x, y = (width - text_width) // 2, height - text_height - 10
-            else:  # bottom-right
-                x, y = width - text_width - 10, height - text_height - 10
-
-            # Draw text
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+
+        # Calculate position
+        if position == 'top-left':
+            x, y = 10, 10
+        elif position == 'top':
+            x, y = (width - text_width) // 2, 10
+        elif position == 'top-right':
+            x, y = width - text_width - 10, 10
+        elif position == 'left':
+            x, y = 10, (height - text_height) // 2
+        elif position == 'center':
+            x, y = (width - text_width) // 2, (height - text_height) // 2
+        elif position == 'right':
+            x, y = width - text_width - 10, (height - text_height) // 2
+        elif position == 'bottom-left':
+            x, y = 10, height - text_height - 10
+        elif position == 'bottom':
+            x, y = (width - text_width) // 2, height - text_height - 10
+        else:  # bottom-right
+            x, y = width - text_width - 10, height - text_height - 10
+
+        # drawtext places the text box itself at x/y, not the text origin
+        if ffmpeg_geometry:
+            x, y = x - bbox[0], y - bbox[1]
+
+        # Draw text
+        with _watermark_font_lock:
             draw.text((x, y), text, font=font, fill=color)
 
-        else:  # logo watermark
-            logo_path = watermark_config.get('watermark_logo_path')
-            if not logo_path:
-                log.error("📸 Watermark FAILED: No logo path provided")
-                return False
-            if not os.path.exists(logo_path):
-                log.error(f"📸 Watermark FAILED: Logo file not found at {logo_path}")
-                return False
+    else:  # logo watermark
+        logo_path = watermark_config.get('watermark_logo_path')
+        if not logo_path:
+            log.error("📸 Watermark FAILED: No logo path provided")
+            return None
+        if not os.path.exists(logo_path):
+            log.error(f"📸 Watermark FAILED: Logo file not found at {logo_path}")
+            return None
+
+        log.info(f"📸 Watermark: Adding logo from {logo_path}")
+
+        # Decoded logo with opacity applied (cached until the file changes)
+        logo = load_watermark_logo(logo_path, os.path.getmtime(logo_path), opacity)
+
+        # Resize logo based on size_percent (FFmpeg's filter scaled the logo itself: iw*size/100)
+        logo_width = max(1, int((logo.size[0] if ffmpeg_geometry else width) * size_percent / 100))
+        logo_height = max(1, int(logo.size[1] * logo_width / logo.size[0]))
+        logo = logo.resize((logo_width, logo_height), Image.Resampling.LANCZOS)
+
+        # Calculate position
+        if position == 'top-left':
+            x, y = 10, 10
+        elif position == 'top':
+            x, y = (width - logo_width) // 2, 10
+        elif position == 'top-right':
+            x, y = width - logo_width - 10, 10
+        elif position == 'left':
+            x, y = 10, (height - logo_height) // 2
+        elif position == 'center':
+            x, y = (width - logo_width) // 2, (height - logo_height) // 2
+        elif position == 'right':
+            x, y = width - logo_width - 10, (height - logo_height) // 2
+        elif position == 'bottom-left':
+            x, y = 10, height - logo_height - 10
+        elif position == 'bottom':
+            x, y = (width - logo_width) // 2, height - logo_height - 10
+        else:  # bottom-right
+            x, y = width - logo_width - 10, height - logo_height - 10
+
+        # Paste logo onto watermark layer
+        watermark_layer.paste(logo, (x, y), logo)
+
+    # Rotate if needed (note: rotation is applied to the entire watermark layer)
+    # Since we need same size for alpha_composite, we don't use expand=True
+    if rotation != 0 and not ffmpeg_geometry:
+        watermark_layer = watermark_layer.rotate(-rotation, fillcolor=(0, 0, 0, 0))
+
+    return watermark_layer
+
+
+def apply_watermark_to_image(input_path: str, output_path: str, watermark_config: dict) -> bool:
+    """
+    Apply watermark to an image using Pillow (PIL).
+
+    Args:
+        input_path: Path to input image
+        output_path: Path to save watermarked image
+        watermark_config: Dictionary with watermark settings
+
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        from PIL import Image
+
+        log.info(f"📸 Watermark: Loading image from {input_path}")
+
+        # Load the main image
+        img = Image.open(input_path).convert('RGBA')
+        width, height = img.size
+        log.info(f"📸 Watermark: Image size {width}x{height}")
 
-            log.info(f"📸 Watermark: Adding logo from {logo_path}")
-
-            # Load logo
-            logo = Image.open(logo_path).convert('RGBA')
-            log.info(f"📸 Watermark: Logo loaded, size: {logo.size[0]}x{logo.size[1]}")
-
-            # Resize logo based on size_percent
-            logo_width = int(width * size_percent / 100)
-            logo_height = int(logo.size[1] * logo_width / logo.size[0])
-            logo = logo.resize((logo_width, logo_height), Image.Resampling.LANCZOS)
-
-            # Apply opacity
-            if opacity < 255:
-                alpha = logo.split()[3]
-                alpha = alpha.point(lambda p: int(p * opacity / 255))
-                logo.putalpha(alpha)
-
-            # Calculate position
-            if position == 'top-left':
-                x, y = 10, 10
-            elif position == 'top':
-                x, y = (width - logo_width) // 2, 10
-            elif position == 'top-right':
-                x, y = width - logo_width - 10, 10
-            elif position == 'left':
-                x, y = 10, (height - logo_height) // 2
-            elif position == 'center':
-                x, y = (width - logo_width) // 2, (height - logo_height) // 2
-            elif position == 'right':
-                x, y = width - logo_width - 10, (height - logo_height) // 2
-            elif position == 'bottom-left':
-                x, y = 10, height - logo_height - 10
-            elif position == 'bottom':
-                x, y = (width - logo_width) // 2, height - logo_height - 10
-            else:  # bottom-right
-                x, y = width - logo_width - 10, height - logo_height - 10
-
-            # Paste logo onto watermark layer
-            watermark_layer.paste(logo, (x, y), logo)
-
-        # Rotate if needed (note: rotation is applied to the entire watermark layer)
-        # Since we need same size for alpha_composite, we don't use expand=True
-        if rotation != 0:
-            watermark_layer = watermark_layer.rotate(-rotation, fillcolor=(0, 0, 0, 0))
+        # Pre-rendered layer for this size and settings (cached)
+        watermark_layer = watermark_overlays.get_image(watermark_config, width, height)
+        if watermark_layer is None:
+            return False
 
         # Composite the watermark onto the original image
         log.info(f"📸 Watermark: Compositing watermark onto image")
@@ -1398,6 +1811,237 @@ def apply_watermark_to_image(input_path: str, output_path: str, watermark_config
         return False
 
 
+class WatermarkOverlayCache:
+    """
+    LRU cache of pre-rendered watermark layers keyed by (watermark settings, resolution).
+
+    Pillow composites layers rendered at the exact image size. FFmpeg gets a
+    PNG rendered at the media resolution, with the drawtext/logo-filter
+    geometry, as an overlay input instead of re-running those filters.
+    Memory (decoded RGBA) plus PNG bytes on disk stay under max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> {'image', 'path', 'bytes'}
+        self._bytes = 0
+        self._dir: Optional[str] = None
+        self._lock = ThreadLock()  # Pillow watermarking runs in worker threads
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def settings_key(watermark_config: dict) -> str:
+        settings = {k: v for k, v in watermark_config.items()
+                    if k.startswith('watermark_') and k not in ('watermark_enabled', 'watermark_logo_file_id')}
+        logo_path = watermark_config.get('watermark_logo_path')
+        if settings.get('watermark_type') == 'logo' and logo_path:
+            try:
+                settings['logo_mtime'] = os.path.getmtime(logo_path)  # logo replaced in place
+            except OSError:
+                pass
+        return json.dumps(settings, sort_keys=True, default=str)
+
+    def _get_entry(self, watermark_config: dict, bw: int, bh: int, ffmpeg_geometry: bool = False) -> Optional[dict]:
+        key = (self.settings_key(watermark_config), bw, bh, ffmpeg_geometry)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        self.misses += 1
+        image = render_watermark_overlay(watermark_config, bw, bh, ffmpeg_geometry)
+        if image is None:
+            return None
+        entry = {'image': image, 'path': None, 'bytes': bw * bh * 4}
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:  # rendered concurrently
+                return existing
+            self._entries[key] = entry
+            self._bytes += entry['bytes']
+            self._evict()
+        return entry
+
+    def _evict(self):
+        # Keep at least the newest entry even if it alone exceeds the cap
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old['bytes']
+            if old['path']:
+                try:
+                    os.remove(old['path'])
+                except OSError:
+                    pass
+
+    def get_image(self, watermark_config: dict, width: int, height: int):
+        """RGBA layer sized exactly width x height, or None."""
+        entry = self._get_entry(watermark_config, width, height)
+        return entry['image'] if entry is not None else None
+
+    def get_path(self, watermark_config: dict, width: int, height: int) -> Optional[str]:
+        """PNG of the layer for FFmpeg (drawtext/logo-filter geometry), or None."""
+        entry = self._get_entry(watermark_config, width, height, ffmpeg_geometry=True)
+        if entry is None:
+            return None
+        with self._lock:
+            if entry['path'] and os.path.exists(entry['path']):
+                return entry['path']
+            if self._dir is None or not os.path.isdir(self._dir):
+                os.makedirs(Config.SPOOL_DIR, exist_ok=True)
+                self._dir = tempfile.mkdtemp(prefix='wm_overlays_', dir=Config.SPOOL_DIR)
+            fd, path = tempfile.mkstemp(suffix='.png', dir=self._dir)
+            os.close(fd)
+        entry['image'].save(path, format='PNG')
+        with self._lock:
+            if entry['path'] is None:
+                entry['path'] = path
+                size = os.path.getsize(path)
+                entry['bytes'] += size
+                self._bytes += size
+                self._evict()
+            else:
+                os.remove(path)
+            return entry['path']
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+watermark_overlays = WatermarkOverlayCache(max_bytes=Config.WATERMARK_OVERLAY_CACHE_MB * 1024 * 1024)
+
+
+class TransformJobTimeout(Exception):
+    """A media transform job exceeded its time budget."""
+    pass
+
+
+class MediaTransformPool:
+    """
+    Bounded worker pool for CPU-heavy media transforms (watermarking).
+
+    At most `workers` jobs run at once; up to `queue_size` more wait in FIFO
+    order and further submitters wait for a free slot (backpressure). Each job
+    gets a timeout once it starts (timeout=0 on submit: none, for jobs that
+    bound themselves). Coroutine functions are awaited on the event
+    loop (FFmpeg runs as a subprocess); plain functions run in a thread.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 100, job_timeout: float = 120.0):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.job_timeout = job_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        # Metrics
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        if not self._worker_tasks:
+            self._worker_tasks = [
+                asyncio.create_task(self._worker(n)) for n in range(self.workers)
+            ]
+            log.info(f"✅ Media transform pool started ({self.workers} workers, queue {self.queue_size})")
+
+    async def submit(self, func, *args, timeout: float = None, **kwargs):
+        """Queue func(*args, **kwargs) and wait for its result."""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = (func, args, kwargs, self.job_timeout if timeout is None else (timeout or None),
+               future, time.monotonic())
+        await self._queue.put(job)
+        self.submitted += 1
+        return await future
+
+    async def _worker(self, n: int):
+        while True:
+            func, args, kwargs, timeout, future, queued_at = await self._queue.get()
+            try:
+                if future.done():  # submitter gave up while queued
+                    continue
+                waited = time.monotonic() - queued_at
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+                if waited > 5:
+                    log.info(f"🎨 Transform job waited {waited:.1f}s for a worker (queue: {self._queue.qsize()})")
+
+                if asyncio.iscoroutinefunction(func):
+                    run = asyncio.ensure_future(func(*args, **kwargs))
+                else:
+                    run = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+                # Submitter cancelled -> cancel the job (kills FFmpeg)
+                future.add_done_callback(lambda f, run=run: run.cancel() if f.cancelled() else None)
+
+                self.running += 1
+                try:
+                    result = await asyncio.wait_for(run, timeout)
+                except asyncio.TimeoutError:
+                    self.timed_out += 1
+                    if not future.done():
+                        future.set_exception(TransformJobTimeout(f"Transform job exceeded {timeout}s"))
+                except asyncio.CancelledError:
+                    if future.cancelled():
+                        continue  # only the job was cancelled; keep the worker alive
+                    run.cancel()
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    self.failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    self.completed += 1
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self.running -= 1
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        """Queue depth, running jobs, counters and wait times."""
+        started = self.completed + self.failed + self.timed_out
+        return {
+            'workers': self.workers,
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'running': self.running,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'avg_wait': self.total_wait / started if started else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+    async def stop(self):
+        """Cancel the workers; queued jobs fail with CancelledError."""
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker_tasks = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                if not job[4].done():
+                    job[4].cancel()
+            self._queue = None
+
+
 # ==================== DATABASE MANAGER ====================
 class DatabaseManager:
     def __init__(self, db_path: str):
@@ -1405,6 +2049,29 @@ class DatabaseManager:
         self._lock = Lock()
         self._pool = DatabaseConnectionPool(db_path, pool_size=20)
         self._initialized = False
+        # Async callbacks fired with the phone whose rules changed
+        self._rule_listeners: List = []
+
+    def add_rule_listener(self, callback):
+        """Register an async callback(phone) invoked after a phone's rules change."""
+        self._rule_listeners.append(callback)
+
+    async def _notify_rules_changed(self, phone: Optional[str]):
+        """Tell listeners (e.g. the in-memory rule index) that a phone's rules changed."""
+        if not phone:
+            return
+        for callback in self._rule_listeners:
+            try:
+                await callback(phone)
+            except Exception as e:
+                log.error(f"Rule listener failed for {phone}: {e}")
+
+    @staticmethod
+    def _get_rule_phone(cursor, rule_id: int) -> Optional[str]:
+        """Look up the phone a rule belongs to (used for change notifications)."""
+        cursor.execute('SELECT phone FROM forward_rules WHERE id = ?', (rule_id,))
+        row = cursor.fetchone()
+        return row['phone'] if row else None
 
     async def ensure_initialized(self):
         """Ensure database is initialized (lazy init)."""
@@ -1464,6 +2131,14 @@ class DatabaseManager:
                 except sqlite3.OperationalError:
                     pass  # Column already exists
 
+            # Per-account parallel transfer settings (NULL = Config default)
+            for col in ('transfer_connections', 'transfer_part_kb'):
+                try:
+                    cursor.execute(f'ALTER TABLE connected_accounts ADD COLUMN {col} INTEGER')
+                    log.info(f"Added {col} column")
+                except sqlite3.OperationalError:
+                    pass  # Column already exists
+
             # File deduplication tracking table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS file_cache (
@@ -1481,7 +2156,54 @@ class DatabaseManager:
                 )
             ''')
 
+            # Delayed posts (delay modifier) waiting for their due time, by message reference
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS scheduled_deliveries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    phone TEXT NOT NULL,
+                    rule_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    due_at REAL NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(rule_id, chat_id, message_id)
+                )
+            ''')
+
+            # Outbound work: one row per (matched message, rule, destination) until delivered
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbound_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    phone TEXT NOT NULL,
+                    rule_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    message_ids TEXT NOT NULL,
+                    destination TEXT NOT NULL,
+                    stage TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL DEFAULT 0,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            try:
+                cursor.execute('ALTER TABLE outbound_jobs ADD COLUMN next_attempt_at REAL DEFAULT 0')
+                log.info("Added next_attempt_at column")
+            except sqlite3.OperationalError:
+                pass  # Column already exists
+
             # Create indexes for faster lookups
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_outbound_jobs_stage
+                ON outbound_jobs(stage, id)
+            ''')
+
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_scheduled_deliveries_due
+                ON scheduled_deliveries(due_at)
+            ''')
+
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_file_cache_lookup
                 ON file_cache(file_unique_id, rule_id, dest_chat_id)
@@ -1550,6 +2272,35 @@ class DatabaseManager:
                 cursor.execute('SELECT phone, display_name, connected_at FROM connected_accounts WHERE user_id = ? AND is_active = 1', (user_id,))
                 return [dict(row) for row in cursor.fetchall()]
     
+    async def get_transfer_settings(self, phone: str) -> tuple:
+        """(connections, part_size_bytes) for parallel transfers on this account."""
+        await self.ensure_initialized()
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT transfer_connections, transfer_part_kb FROM connected_accounts '
+                    'WHERE phone = ? AND is_active = 1 LIMIT 1', (phone,)
+                )
+                row = cursor.fetchone()
+        if not row:
+            return normalize_transfer_settings(None, None)
+        return normalize_transfer_settings(row['transfer_connections'], row['transfer_part_kb'])
+
+    async def set_transfer_settings(self, user_id: int, phone: str, connections: Optional[int], part_kb: Optional[int]) -> bool:
+        """Override parallel transfer settings for an account (None restores the default)."""
+        await self.ensure_initialized()
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'UPDATE connected_accounts SET transfer_connections = ?, transfer_part_kb = ? '
+                    'WHERE user_id = ? AND phone = ? AND is_active = 1',
+                    (connections, part_kb, user_id, phone)
+                )
+                conn.commit()
+                return cursor.rowcount > 0
+
     async def remove_account(self, user_id: int, phone: str):
         async with self._lock:
             async with self._pool.get_connection() as conn:
@@ -1557,6 +2308,7 @@ class DatabaseManager:
                 cursor.execute('UPDATE connected_accounts SET is_active = 0 WHERE user_id = ? AND phone = ?', (user_id, phone))
                 cursor.execute('UPDATE forward_rules SET is_enabled = 0 WHERE user_id = ? AND phone = ?', (user_id, phone))
                 conn.commit()
+        await self._notify_rules_changed(phone)
     
     async def add_forward_rule(self, user_id: int, phone: str, sources: List[str], destinations: List[str], forward_mode: str = "forward", filters: dict = None, modify: dict = None) -> int:
         """Add rule with multiple sources and destinations."""
@@ -1565,7 +2317,7 @@ class DatabaseManager:
             async with self._pool.get_connection() as conn:
                 cursor = conn.cursor()
                 # Store as comma-separated for backward compatibility
-                source_str = ','.join(sources)
+                source_str = ','.join(normalize_source(s) for s in sources)
                 dest_str = ','.join(destinations)
                 filters_str = json.dumps(filters) if filters else None
                 modify_str = json.dumps(modify) if modify else None
@@ -1574,7 +2326,9 @@ class DatabaseManager:
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (user_id, phone, source_str, dest_str, source_str, dest_str, forward_mode, filters_str, modify_str))
                 conn.commit()
-                return cursor.lastrowid
+                rule_id = cursor.lastrowid
+        await self._notify_rules_changed(phone)
+        return rule_id
     
     async def get_user_rules(self, user_id: int) -> List[dict]:
         async with self._lock:
@@ -1651,21 +2405,30 @@ class DatabaseManager:
         async with self._lock:
             async with self._pool.get_connection() as conn:
                 cursor = conn.cursor()
+                phone = self._get_rule_phone(cursor, rule_id)
                 cursor.execute('DELETE FROM forward_rules WHERE id = ? AND user_id = ?', (rule_id, user_id))
                 conn.commit()
-                return cursor.rowcount > 0
-    
+                deleted = cursor.rowcount > 0
+        if deleted:
+            await self._notify_rules_changed(phone)
+        return deleted
+
     async def toggle_rule(self, user_id: int, rule_id: int) -> Optional[bool]:
+        new_state = None
+        phone = None
         async with self._lock:
             async with self._pool.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('UPDATE forward_rules SET is_enabled = 1 - is_enabled WHERE id = ? AND user_id = ?', (rule_id, user_id))
                 conn.commit()
                 if cursor.rowcount > 0:
-                    cursor.execute('SELECT is_enabled FROM forward_rules WHERE id = ?', (rule_id,))
+                    cursor.execute('SELECT is_enabled, phone FROM forward_rules WHERE id = ?', (rule_id,))
                     row = cursor.fetchone()
-                    return bool(row['is_enabled']) if row else None
-                return None
+                    if row:
+                        new_state = bool(row['is_enabled'])
+                        phone = row['phone']
+        await self._notify_rules_changed(phone)
+        return new_state
     
     async def update_rule_mode(self, user_id: int, rule_id: int, mode: str) -> bool:
         """Update rule forward mode."""
@@ -1675,18 +2438,24 @@ class DatabaseManager:
                 cursor.execute('UPDATE forward_rules SET forward_mode = ? WHERE id = ? AND user_id = ?', 
                              (mode, rule_id, user_id))
                 conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                phone = self._get_rule_phone(cursor, rule_id) if updated else None
+        await self._notify_rules_changed(phone)
+        return updated
     
     async def update_rule_sources(self, user_id: int, rule_id: int, sources: List[str]) -> bool:
         """Update rule sources."""
         async with self._lock:
             async with self._pool.get_connection() as conn:
                 cursor = conn.cursor()
-                source_str = ','.join(sources)
+                source_str = ','.join(normalize_source(s) for s in sources)
                 cursor.execute('UPDATE forward_rules SET source = ?, sources = ? WHERE id = ? AND user_id = ?', 
                              (source_str, source_str, rule_id, user_id))
                 conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                phone = self._get_rule_phone(cursor, rule_id) if updated else None
+        await self._notify_rules_changed(phone)
+        return updated
     
     async def update_rule_destinations(self, user_id: int, rule_id: int, destinations: List[str]) -> bool:
         """Update rule destinations."""
@@ -1697,7 +2466,10 @@ class DatabaseManager:
                 cursor.execute('UPDATE forward_rules SET destination = ?, destinations = ? WHERE id = ? AND user_id = ?', 
                              (dest_str, dest_str, rule_id, user_id))
                 conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                phone = self._get_rule_phone(cursor, rule_id) if updated else None
+        await self._notify_rules_changed(phone)
+        return updated
     
     async def update_rule_filters(self, user_id: int, rule_id: int, filters: dict) -> bool:
         """Update rule filters."""
@@ -1708,7 +2480,10 @@ class DatabaseManager:
                 cursor.execute('UPDATE forward_rules SET filters = ? WHERE id = ? AND user_id = ?', 
                              (filters_str, rule_id, user_id))
                 conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                phone = self._get_rule_phone(cursor, rule_id) if updated else None
+        await self._notify_rules_changed(phone)
+        return updated
     
     async def update_rule_modify(self, user_id: int, rule_id: int, modify: dict) -> bool:
         """Update rule modify settings."""
@@ -1719,7 +2494,10 @@ class DatabaseManager:
                 cursor.execute('UPDATE forward_rules SET modify = ? WHERE id = ? AND user_id = ?', 
                              (modify_str, rule_id, user_id))
                 conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                phone = self._get_rule_phone(cursor, rule_id) if updated else None
+        await self._notify_rules_changed(phone)
+        return updated
     
     async def increment_forward_count(self, rule_id: int):
         async with self._lock:
@@ -1771,13 +2549,153 @@ class DatabaseManager:
                 except Exception as e:
                     log.error(f"Failed to mark file as processed: {e}")
 
-    async def clear_old_file_cache(self, days: int = 30):
-        """Clear file cache older than specified days."""
+    async def add_scheduled_delivery(self, phone: str, rule_id: int, chat_id: int,
+                                     message_id: int, due_at: float) -> Optional[int]:
+        """Persist a delayed post; returns its id, or None if already scheduled."""
         async with self._lock:
             async with self._pool.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    DELETE FROM file_cache
+                    INSERT OR IGNORE INTO scheduled_deliveries (phone, rule_id, chat_id, message_id, due_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (phone, rule_id, chat_id, message_id, due_at))
+                conn.commit()
+                return cursor.lastrowid if cursor.rowcount else None
+
+    async def get_scheduled_deliveries(self) -> List[dict]:
+        """All pending delayed posts, earliest first."""
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, phone, rule_id, chat_id, message_id, due_at
+                    FROM scheduled_deliveries ORDER BY due_at
+                ''')
+                return [dict(row) for row in cursor.fetchall()]
+
+    async def delete_scheduled_delivery(self, delivery_id: int):
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM scheduled_deliveries WHERE id = ?', (delivery_id,))
+                conn.commit()
+
+    async def add_outbound_jobs(self, phone: str, rule_id: int, chat_id: int, message_ids: List[int],
+                                destinations: List[str], stage: str = 'pending') -> Dict[str, int]:
+        """Record one job per destination in a single INSERT; returns destination -> job id."""
+        if not destinations:
+            return {}
+        ids = ','.join(str(message_id) for message_id in message_ids)
+        attempts = 1 if stage == 'running' else 0
+        params = []
+        for dest in destinations:
+            params.extend((phone, rule_id, chat_id, ids, dest, stage, attempts))
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    INSERT INTO outbound_jobs (phone, rule_id, chat_id, message_ids, destination, stage, attempts)
+                    VALUES {', '.join(['(?, ?, ?, ?, ?, ?, ?)'] * len(destinations))}
+                    RETURNING id, destination
+                ''', params)
+                job_ids = {row['destination']: row['id'] for row in cursor.fetchall()}
+                conn.commit()
+        return job_ids
+
+    async def claim_outbound_job(self) -> Optional[dict]:
+        """Move the oldest due pending job to 'running' and return it (None if there is none)."""
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM outbound_jobs WHERE stage = 'pending' AND next_attempt_at <= ?
+                    ORDER BY id LIMIT 1
+                ''', (time.time(),))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                cursor.execute('''
+                    UPDATE outbound_jobs SET stage = 'running', attempts = attempts + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND stage = 'pending'
+                ''', (row['id'],))
+                conn.commit()
+                job = dict(row)
+                job['attempts'] += 1
+                return job
+
+    async def finish_outbound_jobs(self, done_ids: List[int]):
+        """Delete delivered jobs (one statement)."""
+        if not done_ids:
+            return
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"DELETE FROM outbound_jobs WHERE id IN ({', '.join('?' * len(done_ids))})",
+                    list(done_ids)
+                )
+                conn.commit()
+
+    async def defer_outbound_jobs(self, job_ids: List[int], delay: float, error: str, max_attempts: int):
+        """Back to 'pending', not claimable for `delay` seconds; 'failed' once max_attempts is reached."""
+        if not job_ids:
+            return
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    UPDATE outbound_jobs
+                    SET stage = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                        next_attempt_at = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE id IN ({', '.join('?' * len(job_ids))})
+                ''', [max_attempts, time.time() + delay, error, *job_ids])
+                conn.commit()
+
+    async def next_outbound_job_at(self) -> Optional[float]:
+        """When the earliest pending job becomes claimable (None if there is none)."""
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT MIN(next_attempt_at) AS due FROM outbound_jobs WHERE stage = 'pending'")
+                row = cursor.fetchone()
+                return row['due'] if row else None
+
+    async def requeue_outbound_jobs(self, max_attempts: int = 5, keep_failed_days: int = 7) -> int:
+        """
+        At startup: jobs left 'running' by the previous process go back to
+        'pending' (or 'failed' after max_attempts); old failed jobs are purged.
+        """
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE outbound_jobs SET stage = 'failed', last_error = 'interrupted too many times'
+                    WHERE stage = 'running' AND attempts >= ?
+                ''', (max_attempts,))
+                cursor.execute("UPDATE outbound_jobs SET stage = 'pending' WHERE stage = 'running'")
+                requeued = cursor.rowcount
+                cursor.execute('''
+                    DELETE FROM outbound_jobs
+                    WHERE stage = 'failed' AND updated_at < datetime('now', '-' || ? || ' days')
+                ''', (keep_failed_days,))
+                conn.commit()
+                return requeued
+
+    async def count_outbound_jobs(self) -> Dict[str, int]:
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT stage, COUNT(*) AS n FROM outbound_jobs GROUP BY stage')
+                return {row['stage']: row['n'] for row in cursor.fetchall()}
+
+    async def clear_old_file_cache(self, days: int = 30):
+        """Clear file cache older than specified days."""
+        async with self._lock:
+            async with self._pool.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    DELETE FROM file_cache
                     WHERE processed_at < datetime('now', '-' || ? || ' days')
                 ''', (days,))
                 deleted = cursor.rowcount
@@ -1786,6 +2704,1481 @@ class DatabaseManager:
                     log.info(f"🧹 Cleared {deleted} old file cache entries")
                 return deleted
 
+# ==================== RULE INDEX ====================
+# Caption cleaner stages in execution order: (filter key, log label, patterns)
+CAPTION_CLEANER_STAGES = (
+    ('clean_hashtag', '#hashtags', (REGEX_HASHTAG,)),
+    ('clean_mention', '@mentions', (REGEX_MENTION,)),
+    ('clean_link', 'links', (REGEX_URL_HTTPS, REGEX_URL_HTTP, REGEX_URL_WWW, REGEX_URL_TG_ME, REGEX_URL_TG_SCHEME)),
+    ('clean_emoji', 'emojis', (REGEX_EMOJI,)),
+    ('clean_phone', 'phones', (REGEX_PHONE_FORMATTED, REGEX_PHONE_SIMPLE)),
+    ('clean_email', 'emails', (REGEX_EMAIL,)),
+)
+
+# Album captions have always used the legacy link/phone/email patterns
+ALBUM_CLEANER_STAGES = (
+    ('clean_hashtag', '#hashtags', (REGEX_HASHTAG,)),
+    ('clean_mention', '@mentions', (REGEX_MENTION,)),
+    ('clean_link', 'links', (REGEX_URL_LEGACY,)),
+    ('clean_emoji', 'emojis', (REGEX_EMOJI,)),
+    ('clean_phone', 'phones', (REGEX_PHONE_BASIC,)),
+    ('clean_email', 'emails', (REGEX_EMAIL_STRICT,)),
+)
+
+CAPTION_CLEANER_KEYS = ('clean_caption',) + tuple(key for key, _, _ in CAPTION_CLEANER_STAGES)
+
+
+def tidy_caption(text: str) -> str:
+    """Collapse whitespace left behind by caption cleaners."""
+    text = REGEX_WHITESPACE_MULTI.sub(' ', text)  # multiple spaces
+    text = REGEX_LINE_TRIM.sub('', text)  # line trim
+    text = REGEX_NEWLINE_MULTI.sub('\n\n', text)  # multiple newlines
+    return text.strip()
+
+
+def build_button_markup(buttons_data: list):
+    """Build Telethon inline markup from stored button rows, or None."""
+    if not buttons_data or not types:
+        return None
+    # Build button rows (Telethon requires KeyboardButtonRow objects)
+    button_rows = []
+    for row in buttons_data:
+        if isinstance(row, list):
+            btn_row = []
+            for btn in row:
+                if isinstance(btn, dict) and 'text' in btn and 'url' in btn:
+                    btn_row.append(types.KeyboardButtonUrl(btn['text'], btn['url']))
+            if btn_row:
+                # Wrap each row in KeyboardButtonRow
+                button_rows.append(types.KeyboardButtonRow(btn_row))
+    if not button_rows:
+        return None
+    return types.ReplyInlineMarkup(button_rows)
+
+
+class RulePlan:
+    """
+    Immutable execution plan compiled once from a rule dict.
+
+    Everything the handlers used to re-derive per message (copy mode, cleaner
+    stages, replace patterns, custom caption entities, button markup) is
+    computed here and only rebuilt when the rule changes.
+    """
+
+    __slots__ = (
+        'rule', 'rule_id', 'phone', 'source_list', 'dest_list', 'forward_mode',
+        'filters', 'modify', 'caption_cleaning_active', 'modify_caption_active',
+        'use_copy_mode', 'remove_caption', 'cleaner_stages', 'album_cleaner_stages',
+        'block_words', 'whitelist_words', 'replace_stages', 'custom_caption',
+        'custom_caption_entities', 'header', 'footer', 'delay_seconds',
+        'button_markup', 'remove_link_preview', 'apply_spoiler', 'media_transform_key',
+        'watermark_key', 'forward_without_author',
+    )
+
+    def __init__(self, rule: dict):
+        _set = object.__setattr__
+        filters = rule.get('filters') or {}
+        modify = rule.get('modify') or {}
+        forward_mode = rule.get('forward_mode') or 'forward'
+
+        _set(self, 'rule', rule)
+        _set(self, 'rule_id', rule['id'])
+        _set(self, 'phone', rule.get('phone'))
+        _set(self, 'source_list', tuple(rule.get('source_list', [])))
+        _set(self, 'dest_list', tuple(rule.get('dest_list', [])))
+        _set(self, 'forward_mode', forward_mode)
+        _set(self, 'filters', filters)
+        _set(self, 'modify', modify)
+
+        # Caption cleaning or modification forces copy mode
+        caption_cleaning_active = any(filters.get(k, False) for k in CAPTION_CLEANER_KEYS)
+        modify_caption_active = any([
+            modify.get('header_enabled', False),
+            modify.get('footer_enabled', False),
+            modify.get('caption_enabled', False),
+            modify.get('replace_enabled', False),
+            modify.get('watermark_enabled', False),  # Watermark requires copy mode
+            modify.get('apply_spoiler', False)  # Spoiler effect requires copy mode
+        ])
+        _set(self, 'caption_cleaning_active', caption_cleaning_active)
+        _set(self, 'modify_caption_active', modify_caption_active)
+        _set(self, 'use_copy_mode', forward_mode == "copy" or caption_cleaning_active or modify_caption_active)
+
+        _set(self, 'remove_caption', bool(filters.get('clean_caption', False)))
+        _set(self, 'cleaner_stages', tuple(
+            (label, patterns) for key, label, patterns in CAPTION_CLEANER_STAGES if filters.get(key, False)
+        ))
+        _set(self, 'album_cleaner_stages', tuple(
+            (label, patterns) for key, label, patterns in ALBUM_CLEANER_STAGES if filters.get(key, False)
+        ))
+
+        block_words = modify.get('block_words', []) if modify.get('block_words_enabled', False) else []
+        whitelist_words = modify.get('whitelist_words', []) if modify.get('whitelist_enabled', False) else []
+        _set(self, 'block_words', tuple((w, w.lower()) for w in block_words))
+        _set(self, 'whitelist_words', tuple(w.lower() for w in whitelist_words))
+
+        # Word replacement: compile user regexes once
+        replace_stages = []
+        if modify.get('replace_enabled', False):
+            for pair in modify.get('replace_pairs', []):
+                old = pair.get('from', '')
+                if not old:
+                    continue
+                pattern = None
+                if pair.get('regex', False):
+                    try:
+                        pattern = re.compile(old)
+                    except re.error as e:
+                        log.error(f"[{rule.get('phone')}] Rule {rule['id']} regex '{old}' invalid: {e}")
+                        continue
+                replace_stages.append((pattern, old, pair.get('to', '')))
+        _set(self, 'replace_stages', tuple(replace_stages))
+
+        custom_caption = modify.get('caption_text', '') if modify.get('caption_enabled', False) else ''
+        _set(self, 'custom_caption', custom_caption)
+        _set(self, 'custom_caption_entities',
+             deserialize_entities(modify.get('caption_entities', [])) if custom_caption else None)
+        _set(self, 'header', modify.get('header_text', '') if modify.get('header_enabled', False) else '')
+        _set(self, 'footer', modify.get('footer_text', '') if modify.get('footer_enabled', False) else '')
+        _set(self, 'delay_seconds', modify.get('delay_seconds', 0) if modify.get('delay_enabled', False) else 0)
+
+        button_markup = None
+        if modify.get('buttons_enabled', False):
+            try:
+                button_markup = build_button_markup(modify.get('buttons', []))
+            except Exception as e:
+                log.error(f"[{rule.get('phone')}] Button creation error: {e}")
+        _set(self, 'button_markup', button_markup)
+
+        _set(self, 'remove_link_preview', bool(filters.get('clean_link', False)))
+        _set(self, 'apply_spoiler', bool(modify.get('apply_spoiler', False)))
+        # Same key => same output file, so matching rules share one download/transform
+        _set(self, 'media_transform_key', media_transform_key(modify))
+        # Watermark settings only: one watermarked file per media and settings, whatever the
+        # rename (applied as the filename attribute when sending)
+        _set(self, 'watermark_key', media_transform_key(modify, rename=False))
+
+        # Copy with nothing to change but (at most) dropping the caption: one server-side
+        # forward with the author hidden replaces the download/re-upload
+        _set(self, 'forward_without_author', bool(
+            self.use_copy_mode
+            and not self.cleaner_stages
+            and not modify_caption_active
+            and button_markup is None
+            and not self.media_transform_key
+        ))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RulePlan is immutable; rebuild it from the rule instead")
+
+    def clean_caption(self, text: str) -> tuple:
+        """Run the cleaner stages. Returns (cleaned_text, removed_labels)."""
+        removed_items = []
+        if self.remove_caption and text:
+            text = ""
+            removed_items.append('entire caption')
+        for label, patterns in self.cleaner_stages:
+            if not text:
+                break
+            before = text
+            for pattern in patterns:
+                text = pattern.sub('', text)
+            if before != text:
+                removed_items.append(label)
+        return tidy_caption(text), removed_items
+
+    def blocked_reason(self, text: str) -> Optional[str]:
+        """Why the block/whitelist words reject this caption, or None to keep it."""
+        if not text:
+            return None
+        text_lower = text.lower()
+        for word, word_lower in self.block_words:
+            if word_lower in text_lower:
+                return f"Contains blocked word '{word}'"
+        if self.whitelist_words and not any(w in text_lower for w in self.whitelist_words):
+            return "Does not contain any whitelist word"
+        return None
+
+    def finish_caption(self, text: str) -> tuple:
+        """Apply replace, custom caption, header and footer. Returns (text, entities)."""
+        entities = None
+        if self.replace_stages and text:
+            for pattern, old, new in self.replace_stages:
+                if pattern is not None:
+                    try:
+                        text = pattern.sub(new, text)
+                    except Exception as e:
+                        log.error(f"[{self.phone}] Regex replace error: {e}")
+                else:
+                    text = text.replace(old, new)
+
+        if self.custom_caption:
+            text = self.custom_caption
+            entities = self.custom_caption_entities
+
+        # Entities only describe the custom caption; any header/footer invalidates them
+        if self.header:
+            text = f"{self.header}\n{text}" if text else self.header
+            entities = None
+        if self.footer:
+            text = f"{text}\n{self.footer}" if text else self.footer
+            entities = None
+        return text, entities
+
+    def album_caption(self, text: str) -> tuple:
+        """Caption pipeline used for albums. Returns (text, entities)."""
+        if self.remove_caption:
+            text = ""
+        elif text:
+            for _, patterns in self.album_cleaner_stages:
+                for pattern in patterns:
+                    text = pattern.sub('', text)
+            text = tidy_caption(text)
+
+        entities = None
+        if self.custom_caption:
+            text = self.custom_caption
+            entities = self.custom_caption_entities
+        if self.header:
+            text = f"{self.header}\n{text}" if text else self.header
+            entities = None
+        if self.footer:
+            text = f"{text}\n{self.footer}" if text else self.footer
+            entities = None
+        return text, entities
+
+
+class RuleIndex:
+    """In-memory snapshot of one account's enabled rules (no I/O on lookup)."""
+
+    def __init__(self, phone: str, rules: List[dict]):
+        self.phone = phone
+        self.rules = rules
+        self.loaded_at = time.time()
+        # Each rule is compiled once per load into an immutable plan
+        self.plans: List[RulePlan] = []
+        for rule in rules:
+            try:
+                self.plans.append(RulePlan(rule))
+            except Exception as e:
+                log.error(f"[{phone}] Failed to compile rule {rule.get('id')}: {e}")
+        # Canonical source key -> plans, in rule order
+        self.by_peer_id: Dict[int, List[RulePlan]] = {}
+        self.by_username: Dict[str, List[RulePlan]] = {}
+        self._order = {id(plan): pos for pos, plan in enumerate(self.plans)}
+
+        for plan in self.plans:
+            for source in plan.source_list:
+                peer_id, username = source_match_keys(source)
+                if peer_id is not None:
+                    bucket = self.by_peer_id.setdefault(peer_id, [])
+                elif username:
+                    bucket = self.by_username.setdefault(username, [])
+                else:
+                    continue
+                # Same rule may list one chat twice (e.g. -100123 and 123)
+                if not bucket or bucket[-1] is not plan:
+                    bucket.append(plan)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, chat_id: int, chat_username: str = None) -> List[RulePlan]:
+        """Plans whose sources include this chat, by peer ID or @username."""
+        matched = self.by_peer_id.get(bare_peer_id(chat_id), [])
+        if not chat_username or not self.by_username:
+            return matched
+
+        by_name = self.by_username.get(chat_username.lower())
+        if not by_name:
+            return matched
+        if not matched:
+            return by_name
+
+        seen = {id(plan) for plan in matched}
+        merged = matched + [plan for plan in by_name if id(plan) not in seen]
+        merged.sort(key=lambda plan: self._order[id(plan)])
+        return merged
+
+
+# ==================== MEDIA ARTIFACTS ====================
+def media_transform_key(modify: dict, rename: bool = True) -> str:
+    """Stable key for the file transforms (rename, watermark) a rule applies; '' if none."""
+    transform = {}
+    if rename and modify.get('rename_enabled', False):
+        rename_pattern = modify.get('rename_pattern', '{original}')
+        if rename_pattern and rename_pattern != '{original}':
+            transform['rename'] = rename_pattern
+    if modify.get('watermark_enabled', False):
+        transform['watermark'] = {k: v for k, v in modify.items() if k.startswith('watermark_')}
+    return json.dumps(transform, sort_keys=True, default=str) if transform else ''
+
+
+def render_media_filename(original_name: str, rename_pattern: str) -> str:
+    """Apply a rename pattern ({original}, {date}, {time}, {random}, {counter}) to a filename."""
+    import random
+
+    original_base, extension = os.path.splitext(original_name)
+    now = datetime.now()
+    new_name = rename_pattern
+    new_name = new_name.replace('{original}', original_base)
+    new_name = new_name.replace('{date}', now.strftime('%Y%m%d'))
+    new_name = new_name.replace('{time}', now.strftime('%H%M%S'))
+    new_name = new_name.replace('{random}', str(random.randint(1000, 9999)))
+    # Note: {counter} would need persistent storage, using random for now
+    new_name = new_name.replace('{counter}', str(random.randint(1, 999)))
+    new_filename = new_name + extension
+
+    # Sanitize filename - remove invalid characters for Windows/Unix
+    for char in '<>:"/\\|?*\n\r\t':
+        new_filename = new_filename.replace(char, '_')
+    # Remove multiple underscores and spaces (pre-compiled pattern)
+    new_filename = REGEX_FILENAME_SPACES.sub('_', new_filename)
+    return new_filename.strip('_')
+
+
+def reference_input_media(media, spoiler: bool = False):
+    """InputMedia that re-sends an existing photo/document by reference (no transfer), or None."""
+    if not types:
+        return None
+    if isinstance(media, types.MessageMediaPhoto) and isinstance(media.photo, types.Photo):
+        photo = media.photo
+        return types.InputMediaPhoto(
+            types.InputPhoto(photo.id, photo.access_hash, photo.file_reference),
+            spoiler=spoiler or None
+        )
+    if isinstance(media, types.MessageMediaDocument) and isinstance(media.document, types.Document):
+        document = media.document
+        return types.InputMediaDocument(
+            types.InputDocument(document.id, document.access_hash, document.file_reference),
+            spoiler=spoiler or None
+        )
+    return None
+
+
+class SpoolFullError(Exception):
+    """Raised when a media job waited too long for spool space."""
+
+
+class SpoolJob:
+    """Private subdirectory of the spool plus the bytes reserved for it."""
+    __slots__ = ('path', 'reserved')
+
+    def __init__(self, path: str, reserved: int):
+        self.path = path
+        self.reserved = reserved
+
+
+class SpoolManager:
+    """
+    Dedicated directory for media work files with a byte quota.
+
+    Each job works in its own subdirectory, so same-named downloads never
+    collide. A job reserves its expected size before it starts and waits
+    while that would exceed the quota (a job larger than the whole quota is
+    admitted once the spool is empty). Follow-on jobs of work that already
+    holds space (the watermark of a download, an album's next item) are
+    admitted without waiting: holding space while waiting for more lets two
+    large jobs starve each other. Whatever is in the directory at startup is
+    debris from a previous run and is swept.
+    """
+
+    def __init__(self, root: str, quota_bytes: int, wait_timeout: float = 600):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.wait_timeout = wait_timeout
+        self._reserved = 0
+        self._jobs = 0
+        self._changed: Optional[asyncio.Event] = None
+        # Metrics
+        self.waiting = 0
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.max_wait = 0.0
+        self.peak_bytes = 0
+        self.swept = 0
+
+    def sweep(self) -> int:
+        """Remove everything under the spool directory; returns the number of entries removed."""
+        import shutil
+        os.makedirs(self.root, exist_ok=True)
+        removed = 0
+        for entry in os.scandir(self.root):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+                removed += 1
+            except OSError as e:
+                log.warning(f"⚠️ Spool sweep could not remove {entry.path}: {e}")
+        self.swept += removed
+        return removed
+
+    def _fits(self, size: int) -> bool:
+        return self._jobs == 0 or self._reserved + size <= self.quota_bytes
+
+    def _notify(self):
+        # Wake every waiter; each re-checks whether its reservation fits now
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    async def open_job(self, size: int = 0, prefix: str = 'job_', wait: bool = True) -> SpoolJob:
+        """Reserve `size` bytes (waiting for space unless `wait` is False) and create the job's directory."""
+        size = max(0, int(size or 0))
+        if wait and not self._fits(size):
+            self.waiting += 1
+            self.waited += 1
+            started = time.monotonic()
+            try:
+                while not self._fits(size):
+                    remaining = started + self.wait_timeout - time.monotonic()
+                    if self._changed is None:
+                        self._changed = asyncio.Event()
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), max(remaining, 0))
+                    except asyncio.TimeoutError:
+                        self.rejected += 1
+                        raise SpoolFullError(
+                            f"No spool space for {size / 1048576:.1f} MB after {self.wait_timeout:.0f}s"
+                        ) from None
+            finally:
+                self.waiting -= 1
+                self.max_wait = max(self.max_wait, time.monotonic() - started)
+        self._reserved += size
+        self._jobs += 1
+        self.admitted += 1
+        self.peak_bytes = max(self.peak_bytes, self._reserved)
+        job = SpoolJob(None, size)
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            job.path = tempfile.mkdtemp(prefix=prefix, dir=self.root)
+        except BaseException:
+            self.close_job(job)
+            raise
+        return job
+
+    def settle(self, job: SpoolJob):
+        """Replace the job's reservation with the bytes it actually holds on disk."""
+        used = 0
+        for dirpath, _, filenames in os.walk(job.path):
+            for name in filenames:
+                try:
+                    used += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+        self._reserved += used - job.reserved
+        job.reserved = used
+        self.peak_bytes = max(self.peak_bytes, self._reserved)
+        self._notify()
+
+    def close_job(self, job: SpoolJob):
+        """Delete the job's directory and return its reservation."""
+        import shutil
+        if job.path:
+            shutil.rmtree(job.path, ignore_errors=True)
+        self._reserved -= job.reserved
+        self._jobs -= 1
+        self._notify()
+
+    def stats(self) -> dict:
+        return {
+            'reserved': self._reserved,
+            'quota': self.quota_bytes,
+            'jobs': self._jobs,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'waited': self.waited,
+            'rejected': self.rejected,
+            'max_wait': self.max_wait,
+            'peak': self.peak_bytes,
+            'swept': self.swept,
+        }
+
+
+class MediaFileCache:
+    """
+    On-disk cache of downloaded media keyed by Telegram media ID, so a photo or
+    document re-posted in other chats/rules is downloaded once.
+
+    Layout: <root>/<media key>/<variant>/<file name>, where variant is
+    'original' or a hash of the transform that produced it. Files are handed
+    out as hardlinks into the caller's work directory, so eviction never pulls
+    a file from under a running job; across filesystems the copy runs in a
+    worker thread, off the event loop.
+    Entries are evicted least-recently-used first once over `max_bytes`, and
+    when older than `max_age` seconds since their last use.
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_age: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # (media key, variant) -> {'dir', 'path', 'bytes', 'used'}, least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._loaded = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def variant_name(transform_key: str = '') -> str:
+        if not transform_key:
+            return 'original'
+        return hashlib.sha1(transform_key.encode('utf-8')).hexdigest()[:16]
+
+    def _load(self):
+        """Index what a previous run left in the cache (last use = mtime)."""
+        self._loaded = True
+        if not os.path.isdir(self.root):
+            return
+        found = []
+        for media_key in os.listdir(self.root):
+            media_dir = os.path.join(self.root, media_key)
+            if not os.path.isdir(media_dir):
+                continue
+            for variant in os.listdir(media_dir):
+                variant_dir = os.path.join(media_dir, variant)
+                names = os.listdir(variant_dir) if os.path.isdir(variant_dir) else []
+                if len(names) != 1 or variant.startswith('.'):
+                    import shutil
+                    shutil.rmtree(variant_dir, ignore_errors=True)  # Half-written entry
+                    continue
+                path = os.path.join(variant_dir, names[0])
+                stat = os.stat(path)
+                found.append((stat.st_mtime, (media_key, variant), variant_dir, path, stat.st_size))
+        for used, key, variant_dir, path, size in sorted(found):
+            self._entries[key] = {'dir': variant_dir, 'path': path, 'bytes': size, 'used': used}
+            self._bytes += size
+        self._evict()
+
+    def _drop(self, key: tuple):
+        import shutil
+        entry = self._entries.pop(key)
+        self._bytes -= entry['bytes']
+        shutil.rmtree(entry['dir'], ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(entry['dir']))  # Media dir, once its last variant is gone
+        except OSError:
+            pass
+
+    def _evict(self):
+        cutoff = time.time() - self.max_age
+        for key in [k for k, e in self._entries.items() if e['used'] < cutoff]:
+            self._drop(key)
+            self.evictions += 1
+        while self._bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def contains(self, media_key: Optional[str], variant: str = 'original') -> bool:
+        """True if the media is cached (doesn't count as a use)."""
+        if not self.enabled or not media_key:
+            return False
+        if not self._loaded:
+            self._load()
+        return (media_key, variant) in self._entries
+
+    def path(self, media_key: Optional[str], variant: str = 'original') -> Optional[str]:
+        """Cached file for the media, marked as just used; None on a miss."""
+        if not self.enabled or not media_key:
+            return None
+        if not self._loaded:
+            self._load()
+        key = (media_key, variant)
+        entry = self._entries.get(key)
+        if entry is not None and (entry['used'] < time.time() - self.max_age or not os.path.exists(entry['path'])):
+            self._drop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['used'] = time.time()
+        self._entries.move_to_end(key)
+        try:
+            os.utime(entry['path'])  # Keeps the LRU order across restarts
+        except OSError:
+            pass
+        return entry['path']
+
+    async def fetch(self, media_key: Optional[str], variant: str, work_dir: str) -> Optional[str]:
+        """Link the cached file into work_dir (same file name); None on a miss."""
+        cached = self.path(media_key, variant)
+        if cached is None:
+            return None
+        target = os.path.join(work_dir, os.path.basename(cached))
+        try:
+            try:
+                os.link(cached, target)
+            except OSError:
+                import shutil
+                await asyncio.to_thread(shutil.copyfile, cached, target)
+        except OSError as e:
+            log.warning(f"⚠️ Media cache read failed for {media_key}: {e}")
+            return None
+        return target
+
+    async def store(self, media_key: Optional[str], variant: str, source: str = None, data: bytes = None,
+                    file_name: str = None):
+        """Add a file (linked/copied from source) or in-memory bytes to the cache."""
+        if not self.enabled or not media_key or (source is None and data is None):
+            return
+        if not self._loaded:
+            self._load()
+        key = (media_key, variant)
+        if key in self._entries:
+            return
+        import shutil
+        file_name = os.path.basename(file_name or source)
+        variant_dir = os.path.join(self.root, media_key, variant)
+        staging = None
+        try:
+            os.makedirs(os.path.join(self.root, media_key), exist_ok=True)
+            staging = tempfile.mkdtemp(prefix='.staging_', dir=os.path.join(self.root, media_key))
+            path = os.path.join(staging, file_name)
+            if data is not None:
+                with open(path, 'wb') as f:
+                    f.write(data)
+            else:
+                try:
+                    os.link(source, path)
+                except OSError:
+                    await asyncio.to_thread(shutil.copyfile, source, path)
+            if key in self._entries:
+                # Stored by another job while this one was copying
+                shutil.rmtree(staging, ignore_errors=True)
+                return
+            shutil.rmtree(variant_dir, ignore_errors=True)
+            os.rename(staging, variant_dir)  # Entry appears complete or not at all
+        except OSError as e:
+            log.warning(f"⚠️ Media cache write failed for {media_key}: {e}")
+            if staging:
+                shutil.rmtree(staging, ignore_errors=True)
+            return
+        path = os.path.join(variant_dir, file_name)
+        size = os.path.getsize(path)
+        self._entries[key] = {'dir': variant_dir, 'path': path, 'bytes': size, 'used': time.time()}
+        self._bytes += size
+        self._evict()
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+def media_cache_key(msg) -> Optional[str]:
+    """Cache key of a message's photo/document (its Telegram ID), or None."""
+    photo = getattr(msg, 'photo', None)
+    if photo is not None and getattr(photo, 'id', None):
+        return f"photo_{photo.id}"
+    document = getattr(msg, 'document', None)
+    if document is not None and getattr(document, 'id', None):
+        return f"document_{document.id}"
+    return None
+
+
+class MediaArtifact:
+    """One downloaded (and possibly transformed) media file shared by several sends."""
+
+    __slots__ = ('key', 'path', 'job', 'refs', 'ready', 'error')
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.path: Optional[str] = None
+        self.job: Optional[SpoolJob] = None
+        self.refs = 0
+        self.ready = asyncio.Event()
+        self.error: Optional[BaseException] = None
+
+
+class MediaArtifactStore:
+    """
+    Reference-counted media files keyed by (phone, chat_id, message_id, transform).
+
+    The first acquirer runs the producer in a private spool job directory;
+    later acquirers wait for it and share the result. The directory is
+    removed when the last reference is released.
+    """
+
+    def __init__(self, spool: SpoolManager):
+        self.spool = spool
+        self._artifacts: Dict[tuple, MediaArtifact] = {}
+
+    def __len__(self):
+        return len(self._artifacts)
+
+    async def acquire(self, key: tuple, producer, size: int = 0, follow_on: bool = False) -> Optional[str]:
+        """
+        Take a reference to the artifact, producing it via `await producer(work_dir)`
+        once; `size` is the expected output size reserved in the spool up front
+        (without waiting for space if the caller already holds some: `follow_on`).
+        """
+        artifact = self._artifacts.get(key)
+        if artifact is not None:
+            artifact.refs += 1
+            await artifact.ready.wait()
+            if artifact.error is not None:
+                raise artifact.error
+            return artifact.path
+
+        artifact = MediaArtifact(key)
+        artifact.refs = 1
+        self._artifacts[key] = artifact
+        try:
+            artifact.job = await self.spool.open_job(size, prefix='fwd_media_', wait=not follow_on)
+            artifact.path = await producer(artifact.job.path)
+            self.spool.settle(artifact.job)
+        except BaseException as e:
+            artifact.error = e
+            raise
+        finally:
+            artifact.ready.set()
+        return artifact.path
+
+    def is_ready(self, key: tuple) -> bool:
+        """True if the artifact exists and was produced successfully."""
+        artifact = self._artifacts.get(key)
+        return artifact is not None and artifact.ready.is_set() and artifact.error is None
+
+    def release(self, key: tuple):
+        """Drop a reference; the last one deletes the files."""
+        artifact = self._artifacts.get(key)
+        if artifact is None:
+            return
+        artifact.refs -= 1
+        if artifact.refs > 0:
+            return
+        del self._artifacts[key]
+        if artifact.job is not None:
+            self.spool.close_job(artifact.job)
+
+
+class MessageMediaScope:
+    """Artifacts used while handling one message; holds one reference per key until closed."""
+
+    def __init__(self, store: MediaArtifactStore):
+        self.store = store
+        self._keys: List[tuple] = []
+        # Local file path(s) -> media of the first message sent with them, for re-sending by reference
+        self.uploads: Dict[object, object] = {}
+        # Small media downloaded into memory (key -> download task), dropped with the scope
+        self._buffers: Dict[tuple, asyncio.Future] = {}
+        self._upload_locks: Dict[object, asyncio.Lock] = {}
+
+    async def get(self, key: tuple, producer, size: int = 0) -> Optional[str]:
+        # Once this message holds a finished artifact, the next ones build on it and don't wait for space
+        follow_on = any(self.store.is_ready(held) for held in self._keys)
+        if key in self._keys:
+            # Already referenced by this message - the store returns the shared result
+            try:
+                return await self.store.acquire(key, producer, size, follow_on)
+            finally:
+                self.store.release(key)
+        self._keys.append(key)
+        return await self.store.acquire(key, producer, size, follow_on)
+
+    def first_upload(self, key):
+        """
+        Async context for sending with uploads[key]: destinations running
+        concurrently queue behind the first upload and then re-send it by
+        reference; once uploaded, nothing is held.
+        """
+        if key in self.uploads:
+            return nullcontext()
+        return self._upload_locks.setdefault(key, asyncio.Lock())
+
+    async def get_bytes(self, key: tuple, producer) -> Optional[bytes]:
+        """In-memory counterpart of get(): producer() runs once, every caller gets its bytes."""
+        task = self._buffers.get(key)
+        if task is None:
+            task = self._buffers[key] = asyncio.ensure_future(producer())
+        return await asyncio.shield(task)
+
+    def close(self):
+        buffers, self._buffers = self._buffers, {}
+        for task in buffers.values():
+            task.cancel()
+        keys, self._keys = self._keys, []
+        for key in reversed(keys):
+            self.store.release(key)
+
+
+class MediaChunkPipe:
+    """
+    Bounded async byte pipe from a chunk iterator (client.iter_download) to a
+    reader that pulls fixed-size parts (client.upload_file).
+
+    At most `max_chunks` downloaded chunks are buffered ahead of the reader,
+    so a streaming copy never holds the whole file in memory or on disk.
+    """
+
+    def __init__(self, chunks, size: int, name: str = None, max_chunks: int = 8):
+        self.size = size
+        self.name = name
+        self._chunks = chunks
+        self._queue = asyncio.Queue(maxsize=max(1, max_chunks))
+        self._buffer = bytearray()
+        self._eof = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def _pump(self):
+        try:
+            async for chunk in self._chunks:
+                await self._queue.put(bytes(chunk))
+            await self._queue.put(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._queue.put(e)
+
+    async def read(self, n: int = -1) -> bytes:
+        """Next n bytes (fewer only at the end); all remaining bytes if n < 0."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._pump())
+        while not self._eof and (n < 0 or len(self._buffer) < n):
+            item = await self._queue.get()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                self._buffer += item
+        if n < 0:
+            n = len(self._buffer)
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    async def aclose(self):
+        """Stop the download side (safe to call more than once)."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+# ==================== PARALLEL TRANSFER ====================
+TRANSFER_PART_SIZES_KB = (32, 64, 128, 256, 512, 1024)
+
+
+def normalize_transfer_settings(connections: Optional[int], part_kb: Optional[int]) -> tuple:
+    """
+    (connections, part_size_bytes) from per-account values, falling back to
+    Config. Part size is snapped to a size upload.getFile accepts: a power of
+    two dividing 1 MB, so no part ever crosses a 1 MB boundary.
+    """
+    connections = max(1, min(int(connections or Config.TRANSFER_CONNECTIONS), 16))
+    part_kb = int(part_kb or Config.TRANSFER_PART_KB)
+    part_kb = max([size for size in TRANSFER_PART_SIZES_KB if size <= part_kb], default=TRANSFER_PART_SIZES_KB[0])
+    return connections, part_kb * 1024
+
+
+class TransferSenders:
+    """
+    Extra MTProto connections to one data centre, for moving file parts in
+    parallel next to the client's own connection.
+
+    The home DC reuses the session's auth key; any other DC gets the
+    authorization exported once and imported on the first connection, whose
+    auth key the remaining connections then share.
+    """
+
+    def __init__(self, client, dc_id: int, count: int):
+        self.client = client
+        self.dc_id = dc_id
+        self.count = count
+        self.senders: list = []
+
+    async def _connect_one(self, dc, auth_key):
+        client = self.client
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address, dc.port, dc.id,
+            loggers=client._log, proxy=client._proxy, local_addr=client._local_addr
+        ))
+        return sender
+
+    async def __aenter__(self):
+        client = self.client
+        dc = await client._get_dc(self.dc_id)
+        auth_key = client.session.auth_key if self.dc_id == client.session.dc_id else None
+        try:
+            if auth_key is None:
+                sender = await self._connect_one(dc, None)
+                self.senders.append(sender)
+                exported = await client(functions.auth.ExportAuthorizationRequest(self.dc_id))
+                client._init_request.query = functions.auth.ImportAuthorizationRequest(
+                    id=exported.id, bytes=exported.bytes
+                )
+                await sender.send(functions.InvokeWithLayerRequest(LAYER, client._init_request))
+                auth_key = sender.auth_key
+            while len(self.senders) < self.count:
+                self.senders.append(await self._connect_one(dc, auth_key))
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        senders, self.senders = self.senders, []
+        await asyncio.gather(*(sender.disconnect() for sender in senders), return_exceptions=True)
+
+    async def invoke(self, index: int, request, retries: int = 3):
+        """Send request on connection `index`; FloodWait is slept off, other errors retried."""
+        for attempt in range(retries + 1):
+            try:
+                return await self.senders[index % len(self.senders)].send(request)
+            except errors.FloodWaitError as e:
+                if e.seconds > 60 or attempt == retries:
+                    raise
+                await asyncio.sleep(e.seconds)
+            except (ConnectionError, asyncio.TimeoutError, errors.RPCError) as e:
+                if attempt == retries:
+                    raise
+                log.debug(f"Part transfer retry {attempt + 1} on DC {self.dc_id}: {e}")
+                await asyncio.sleep(1 + attempt)
+
+
+class ParallelDownloader:
+    """
+    Downloads a document in fixed-size parts over several connections at once.
+
+    Parts are fetched up to 2 per connection ahead of the reader and come out
+    of iter_chunks() in order, so the result can feed a stream (upload,
+    FFmpeg stdin) as well as a file.
+    """
+
+    def __init__(self, client, media, connections: int = 4, part_size: int = 512 * 1024,
+                 progress_callback=None):
+        document = getattr(media, 'document', media)
+        self.client = client
+        self.size = document.size
+        self.dc_id, self.location = tl_utils.get_input_location(document)
+        self.connections = connections
+        self.part_size = part_size
+        self.progress_callback = progress_callback
+
+    async def iter_chunks(self):
+        parts = -(-self.size // self.part_size)
+        window = self.connections * 2
+        done = 0
+        async with TransferSenders(self.client, self.dc_id, self.connections) as transfer:
+            async def fetch(index):
+                result = await transfer.invoke(index, functions.upload.GetFileRequest(
+                    self.location, offset=index * self.part_size, limit=self.part_size
+                ))
+                return result.bytes
+
+            pending: Dict[int, asyncio.Task] = {}
+            submitted = 0
+            try:
+                for index in range(parts):
+                    while submitted < parts and submitted < index + window:
+                        pending[submitted] = asyncio.ensure_future(fetch(submitted))
+                        submitted += 1
+                    data = await pending.pop(index)
+                    done += len(data)
+                    if self.progress_callback:
+                        self.progress_callback(done, self.size)
+                    yield data
+            finally:
+                for task in pending.values():
+                    task.cancel()
+                await asyncio.gather(*pending.values(), return_exceptions=True)
+        if done != self.size:
+            raise IOError(f"Parallel download got {done} of {self.size} bytes")
+
+    async def download(self, path: str) -> str:
+        """Download into path (written sequentially, in part order)."""
+        try:
+            with open(path, 'wb') as f:
+                async for chunk in self.iter_chunks():
+                    f.write(chunk)
+        except BaseException:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            raise
+        return path
+
+
+class ParallelUploader:
+    """
+    Uploads a file in parts over several connections to the home data centre.
+
+    The source is a path or an object with an async read(n) (MediaChunkPipe);
+    it is read sequentially while up to 2 parts per connection are in flight.
+    The result is the InputFile/InputFileBig handle that send_file accepts in
+    place of a path, with the caller's attributes and thumbnail.
+    """
+
+    MAX_PART_SIZE = 512 * 1024
+    MAX_PARTS = 4000
+    BIG_FILE_SIZE = 10 * 1024 * 1024
+
+    def __init__(self, client, size: int, file_name: str, connections: int = 4,
+                 part_size: int = 512 * 1024, progress_callback=None):
+        self.client = client
+        self.size = size
+        self.file_name = file_name
+        self.connections = connections
+        # Sized for the file like Telethon does (Telegram caps the part count);
+        # the account's configured size only when it means fewer parts
+        self.part_size = min(
+            max(part_size, tl_utils.get_appropriated_part_size(size) * 1024),
+            self.MAX_PART_SIZE
+        )
+        self.progress_callback = progress_callback
+
+    async def upload(self, source):
+        parts = max(1, -(-self.size // self.part_size))
+        if parts > self.MAX_PARTS:
+            # Before reading anything, so the caller can still fall back
+            raise ValueError(f"{self.size} bytes needs {parts} parts (Telegram allows {self.MAX_PARTS})")
+        is_big = self.size > self.BIG_FILE_SIZE
+        file_id = int.from_bytes(os.urandom(8), 'big', signed=True)
+        md5 = None if is_big else hashlib.md5()
+        slots = asyncio.Semaphore(self.connections * 2)
+        read = sent = 0
+
+        if isinstance(source, str):
+            handle = open(source, 'rb')
+
+            async def read_part():
+                return handle.read(self.part_size)
+        else:
+            handle = None
+
+            async def read_part():
+                return await source.read(self.part_size)
+
+        async with TransferSenders(self.client, self.client.session.dc_id, self.connections) as transfer:
+            async def save(index, data):
+                nonlocal sent
+                try:
+                    if is_big:
+                        request = functions.upload.SaveBigFilePartRequest(file_id, index, parts, data)
+                    else:
+                        request = functions.upload.SaveFilePartRequest(file_id, index, data)
+                    if not await transfer.invoke(index, request):
+                        raise IOError(f"Part {index} of {self.file_name} was not saved")
+                    sent += len(data)
+                    if self.progress_callback:
+                        self.progress_callback(sent, self.size)
+                finally:
+                    slots.release()
+
+            tasks = []
+            try:
+                for index in range(parts):
+                    data = await read_part()
+                    if (len(data) != self.part_size and index != parts - 1) or (not data and self.size):
+                        raise IOError(f"Short read on part {index} of {self.file_name}")
+                    read += len(data)
+                    if md5 is not None:
+                        md5.update(data)
+                    await slots.acquire()
+                    tasks.append(asyncio.ensure_future(save(index, data)))
+                    # Surface a failed part before reading further
+                    failed = next((t for t in tasks if t.done() and t.exception()), None)
+                    if failed:
+                        failed.result()
+                if read != self.size:
+                    raise IOError(f"Read {read} of {self.size} bytes from {self.file_name}")
+                await asyncio.gather(*tasks)
+            finally:
+                if handle is not None:
+                    handle.close()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        if is_big:
+            return types.InputFileBig(file_id, parts, self.file_name)
+        return types.InputFile(file_id, parts, self.file_name, md5.hexdigest())
+
+
+# ==================== SCHEDULED DELIVERY ====================
+class ScheduledMessageEvent:
+    """Stand-in for a NewMessage event when a delayed post is released."""
+
+    def __init__(self, message):
+        self.message = message
+        self.chat_id = message.chat_id
+        self.chat = getattr(message, 'chat', None)
+
+    async def get_chat(self):
+        return await self.message.get_chat()
+
+
+class DeliveryScheduler:
+    """
+    Releases delayed posts on time without a parked coroutine per post.
+
+    Pending deliveries live in SQLite (scheduled_deliveries) and, while the
+    bot runs, in a heap of small tuples ordered by due time. One task sleeps
+    until the earliest is due, then hands it to `dispatch(job)` and deletes
+    the row once dispatch finishes, so a crash before then re-delivers it
+    after restart (at least once). If dispatch raises (connection error,
+    FloodWait while fetching the post), the row stays and the release is
+    retried with backoff, up to MAX_ATTEMPTS times.
+    """
+
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 30
+    MAX_RETRY_DELAY = 1800
+
+    def __init__(self, db: DatabaseManager, dispatch):
+        self.db = db
+        self.dispatch = dispatch
+        self._heap: list = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        # delivery id -> failed releases so far (this run)
+        self._attempts: Dict[int, int] = {}
+        self.released = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, job: dict):
+        import heapq
+        heapq.heappush(self._heap, (job['due_at'], job['id'], job['phone'], job['rule_id'],
+                                    job['chat_id'], job['message_id']))
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self):
+        """Load pending deliveries (overdue ones run right away) and start releasing."""
+        if self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        for job in await self.db.get_scheduled_deliveries():
+            self._push(job)
+        if self._heap:
+            log.info(f"⏰ {len(self._heap)} scheduled deliveries pending")
+        self._task = asyncio.create_task(self._run())
+
+    async def schedule(self, phone: str, rule_id: int, chat_id: int, message_id: int, delay: float) -> bool:
+        """Persist and queue a delivery `delay` seconds from now; False if already scheduled."""
+        due_at = time.time() + delay
+        delivery_id = await self.db.add_scheduled_delivery(phone, rule_id, chat_id, message_id, due_at)
+        if delivery_id is None:
+            return False
+        self._push({'id': delivery_id, 'phone': phone, 'rule_id': rule_id,
+                    'chat_id': chat_id, 'message_id': message_id, 'due_at': due_at})
+        return True
+
+    async def _run(self):
+        import heapq
+        while True:
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due_at, delivery_id, phone, rule_id, chat_id, message_id = heapq.heappop(self._heap)
+            job = {'id': delivery_id, 'phone': phone, 'rule_id': rule_id,
+                   'chat_id': chat_id, 'message_id': message_id, 'due_at': due_at}
+            task = asyncio.create_task(self._release(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _release(self, job: dict):
+        try:
+            retry_in = await self.dispatch(job)
+        except Exception as e:
+            attempts = self._attempts[job['id']] = self._attempts.get(job['id'], 0) + 1
+            if attempts < self.MAX_ATTEMPTS:
+                retry_in = min(self.MAX_RETRY_DELAY, self.RETRY_DELAY * 2 ** (attempts - 1))
+                log.warning(f"⚠️ Scheduled delivery {job['id']} failed ({e}), retrying in {retry_in}s "
+                            f"(attempt {attempts}/{self.MAX_ATTEMPTS})")
+                job['due_at'] = time.time() + retry_in
+                self._push(job)
+                return
+            log.error(f"❌ Scheduled delivery {job['id']} failed after {attempts} attempts: {e}")
+            retry_in = None
+        if retry_in:
+            # Account not connected (yet): try again later, the row stays as is
+            job['due_at'] = time.time() + retry_in
+            self._push(job)
+            return
+        self._attempts.pop(job['id'], None)
+        self.released += 1
+        try:
+            await self.db.delete_scheduled_delivery(job['id'])
+        except Exception as e:
+            log.error(f"❌ Could not remove scheduled delivery {job['id']}: {e}")
+
+    async def stop(self):
+        tasks = [t for t in [self._task, *self._running] if t is not None]
+        self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ==================== FORWARD BATCHING ====================
+class ForwardBatcher:
+    """
+    Coalesces plain forwards that share a key (rule, source chat, destination)
+    and arrive within `window` seconds into one `send(dest_entity, messages)`
+    call, in message order. Telegram takes up to 100 ids per forward, so a
+    full batch goes out at once. Each caller waits for its batch; if the
+    batched call fails, its messages are retried one by one so one bad
+    message only fails its own caller.
+
+    With `slots` (the caller's fan-out semaphore, one permit held by each
+    caller), callers give their permit back while the batch fills and the
+    flush takes a single permit for the send itself.
+    """
+
+    MAX_BATCH = 100
+
+    def __init__(self, send, window: float, label: str = '', slots: asyncio.Semaphore = None):
+        self.send = send
+        self.window = window
+        self.label = label
+        self.slots = slots
+        self._pending: Dict[tuple, tuple] = {}
+        self._tasks: set = set()
+        self.calls = 0
+        self.forwarded = 0
+
+    async def forward(self, key: tuple, dest_entity, message):
+        if self.window <= 0:
+            await self.send(dest_entity, [message])
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = (dest_entity, [])
+            loop.call_later(self.window, self._flush, key, pending)
+        pending[1].append((message, future))
+        if len(pending[1]) >= self.MAX_BATCH:
+            self._flush(key, pending)
+        if self.slots is None:
+            await future
+            return
+        self.slots.release()
+        try:
+            await future
+        finally:
+            await self._reacquire()
+
+    async def _reacquire(self):
+        """Take the caller's permit back; completes even if cancelled, since the caller's `async with` releases it."""
+        acquire = asyncio.ensure_future(self.slots.acquire())
+        cancelled = False
+        while not acquire.done():
+            try:
+                await asyncio.shield(acquire)
+            except asyncio.CancelledError:
+                cancelled = True
+        if cancelled:
+            raise asyncio.CancelledError
+
+    def _flush(self, key: tuple, pending: tuple):
+        # The timer of a batch that already went out full is a no-op
+        if self._pending.get(key) is not pending:
+            return
+        del self._pending[key]
+        task = asyncio.create_task(self._deliver(*pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, dest_entity, batch: list):
+        batch.sort(key=lambda item: item[0].id)
+        try:
+            async with self.slots if self.slots is not None else nullcontext():
+                try:
+                    await self.send(dest_entity, [message for message, _ in batch])
+                except Exception as e:
+                    if len(batch) == 1:
+                        raise
+                    log.warning(f"⚠️ [{self.label}] Batched forward of {len(batch)} failed ({e}), forwarding one by one")
+                    await self._deliver_each(dest_entity, batch)
+                    return
+        except BaseException as e:
+            # Nobody may be left waiting on a batch that never went out (cancelled included)
+            for _, future in batch:
+                if not future.done():
+                    if isinstance(e, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        self.calls += 1
+        self.forwarded += len(batch)
+        if len(batch) > 1:
+            log.info(f"📦 [{self.label}] Forwarded {len(batch)} messages in one call")
+        for _, future in batch:
+            if not future.done():
+                future.set_result(True)
+
+    async def _deliver_each(self, dest_entity, batch: list):
+        for message, future in batch:
+            if future.done():
+                continue
+            try:
+                await self.send(dest_entity, [message])
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.calls += 1
+                self.forwarded += 1
+                if not future.done():
+                    future.set_result(True)
+
+
+# ==================== OUTBOUND JOBS ====================
+class OutboundJobQueue:
+    """
+    Durable record of matched work: one outbound_jobs row per (message, rule,
+    destination) from the moment a message matches until it is delivered.
+
+    Live messages are recorded already claimed ('running') and delivered by the
+    handler right away; a row is deleted on delivery. Rows a crash leaves
+    'running' are requeued at startup and claimed by workers here, which
+    re-fetch the message and deliver it (at least once). A job that wasn't
+    delivered or can't run yet (send error, account offline) is deferred
+    with a growing delay instead of holding a worker, and fails for good
+    after MAX_ATTEMPTS attempts.
+    """
+
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 30
+    MAX_RETRY_DELAY = 3600
+
+    def __init__(self, db: DatabaseManager, dispatch, workers: int = 2):
+        self.db = db
+        self.dispatch = dispatch
+        self.workers = workers
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.recovered = 0
+
+    async def record(self, phone: str, rule_id: int, chat_id: int, message_ids: List[int],
+                     destinations) -> Dict[str, int]:
+        """Jobs for a live delivery (claimed by the caller); destination -> job id."""
+        try:
+            return await self.db.add_outbound_jobs(
+                phone, rule_id, chat_id, message_ids, list(destinations), stage='running'
+            )
+        except Exception as e:
+            # Durability is best effort; never drop the live delivery over it
+            log.error(f"❌ [{phone}] Could not record outbound jobs: {e}")
+            return {}
+
+    async def finish(self, results: Dict[int, Optional[bool]]):
+        """
+        Live jobs (first attempt), job id -> delivered: True/None (skipped)
+        removes the job; False leaves it to the workers to retry.
+        """
+        try:
+            await self.db.finish_outbound_jobs(
+                [job_id for job_id, delivered in results.items() if delivered is not False]
+            )
+            await self.db.defer_outbound_jobs(
+                [job_id for job_id, delivered in results.items() if delivered is False],
+                self.RETRY_DELAY, 'not delivered', self.MAX_ATTEMPTS
+            )
+        except Exception as e:
+            log.error(f"❌ Could not finish outbound jobs {list(results)}: {e}")
+        if any(delivered is False for delivered in results.values()):
+            self._notify()
+
+    def _notify(self):
+        """New or deferred pending jobs: idle workers re-check when the next one is due."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _defer(self, job: dict, base_delay: float, error: str):
+        delay = min(self.MAX_RETRY_DELAY, base_delay * 2 ** (job['attempts'] - 1))
+        await self.db.defer_outbound_jobs([job['id']], delay, error, self.MAX_ATTEMPTS)
+        self._notify()
+        if job['attempts'] >= self.MAX_ATTEMPTS:
+            log.warning(f"♻️ Outbound job {job['id']} failed after {job['attempts']} attempts: {error}")
+
+    async def recover(self):
+        """
+        Requeue work interrupted by the last shutdown/crash. Must run before any
+        handler can record live ('running') jobs, or those would be requeued too.
+        """
+        self.recovered = await self.db.requeue_outbound_jobs(self.MAX_ATTEMPTS)
+        if self.recovered:
+            log.info(f"♻️ Resuming {self.recovered} interrupted outbound jobs")
+
+    async def start(self):
+        """Start the workers (after recover())."""
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.workers))]
+
+    async def _worker(self):
+        while True:
+            job = await self.db.claim_outbound_job()
+            if job is None:
+                # Sleep until the earliest deferred job is due (at most 30s) or new work arrives
+                self._wake.clear()
+                due = await self.db.next_outbound_job_at()
+                timeout = 30 if due is None else min(30, max(0.05, due - time.time()))
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                retry_in = await self.dispatch(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"❌ Outbound job {job['id']} failed: {e}")
+                await self._defer(job, self.RETRY_DELAY, str(e)[:500])
+                continue
+            if retry_in:
+                # Account not connected yet: the worker moves on, the job waits its turn
+                await self._defer(job, retry_in, 'account not connected')
+            elif job.get('delivered') is False:
+                # Send failed (FloodWait, network, ...): retried later with backoff
+                await self._defer(job, self.RETRY_DELAY, 'not delivered')
+            else:
+                # Delivered, skipped as a duplicate, or no longer wanted (rule, filter or message gone)
+                await self.db.finish_outbound_jobs([job['id']])
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 # ==================== SESSION MANAGER ====================
 class UserSessionManager:
     def __init__(self, db: DatabaseManager):
@@ -1797,8 +4190,149 @@ class UserSessionManager:
         self.album_cache_manager = AlbumCacheManager(ttl_seconds=5, cleanup_interval=10)
         # Entity resolution cache for performance
         self.entity_cache = LRUCache(max_size=5000, ttl_seconds=3600)
+        # chat_id -> lowercase username ('' if none), for @username sources only
+        self.chat_info_cache = LRUCache(max_size=5000, ttl_seconds=3600)
+        # Downloaded/transformed media shared by every destination and rule of a message
+        self.spool = SpoolManager(
+            Config.SPOOL_DIR, Config.SPOOL_QUOTA_MB * 1024 * 1024, wait_timeout=Config.SPOOL_WAIT_TIMEOUT
+        )
+        self.media_store = MediaArtifactStore(self.spool)
+        self.media_cache = MediaFileCache(
+            Config.MEDIA_CACHE_DIR, Config.MEDIA_CACHE_MB * 1024 * 1024,
+            max_age=Config.MEDIA_CACHE_MAX_AGE_HOURS * 3600
+        )
+        # Watermark jobs are scheduled here instead of spawning unbounded FFmpeg processes
+        self.transform_pool = MediaTransformPool(
+            workers=Config.TRANSFORM_WORKERS,
+            queue_size=Config.TRANSFORM_QUEUE_SIZE,
+            job_timeout=Config.TRANSFORM_JOB_TIMEOUT
+        )
         self._album_cache_started = False
-    
+        # Per-phone rule index, rebuilt only when the DB reports a rule change
+        self.rule_indexes: Dict[str, RuleIndex] = {}
+        self._rule_versions: Dict[str, int] = {}
+        self.db.add_rule_listener(self.refresh_rules)
+        # Per-phone NewMessage callbacks, registered with a source-chat filter
+        self.forward_handlers: Dict[str, callable] = {}
+        # Delayed posts (delay modifier), persisted and released on time
+        self.scheduler = DeliveryScheduler(db, self.deliver_scheduled)
+        # Every matched delivery is journaled until sent; interrupted ones resume here
+        self.jobs = OutboundJobQueue(db, self.run_outbound_job)
+        self.job_runners: Dict[str, callable] = {}
+        # Per-phone send pacing (account and destination token buckets)
+        self.send_pacers: Dict[str, SendPacer] = {}
+
+    async def deliver_scheduled(self, job: dict) -> Optional[float]:
+        """
+        Run a released delayed post through the account's handler for its rule.
+        Returns seconds to retry after if the account isn't connected, else None.
+        """
+        phone = job['phone']
+        client = self.clients.get(phone)
+        handler = self.forward_handlers.get(phone)
+        if client is None or handler is None or not client.is_connected():
+            if phone not in await self.db.get_all_active_phones():
+                log.warning(f"⏰ Dropping scheduled delivery {job['id']}: account {phone} removed")
+                return None
+            return 60
+        message = await client.get_messages(job['chat_id'], ids=job['message_id'])
+        if message is None:
+            log.warning(f"⏰ [{phone}] Scheduled message {job['message_id']} no longer exists")
+            return None
+        log.info(f"⏰ [{phone}] Releasing delayed post {job['message_id']} (rule {job['rule_id']})")
+        await handler(ScheduledMessageEvent(message), scheduled_rule_id=job['rule_id'])
+        return None
+
+    async def run_outbound_job(self, job: dict) -> Optional[float]:
+        """
+        Deliver an interrupted outbound job through the account's handler.
+        Returns seconds to retry after if the account isn't connected, else None.
+        """
+        phone = job['phone']
+        client = self.clients.get(phone)
+        runner = self.job_runners.get(phone)
+        if client is None or runner is None or not client.is_connected():
+            if phone not in await self.db.get_all_active_phones():
+                log.warning(f"♻️ Dropping outbound job {job['id']}: account {phone} removed")
+                return None
+            return 60
+        ids = [int(message_id) for message_id in job['message_ids'].split(',')]
+        messages = [m for m in await client.get_messages(job['chat_id'], ids=ids) if m is not None]
+        if not messages:
+            log.warning(f"♻️ [{phone}] Outbound job {job['id']}: source messages no longer exist")
+            return None
+        log.info(f"♻️ [{phone}] Resuming delivery of {len(messages)} message(s) -> {job['destination']} (attempt {job['attempts']})")
+        await runner(job, messages)
+        return None
+
+    def _get_lock(self, phone: str) -> Lock:
+        if phone not in self._locks:
+            self._locks[phone] = Lock()
+        return self._locks[phone]
+
+    async def get_rule_index(self, phone: str) -> RuleIndex:
+        """Return the cached rule index for a phone, loading it on first use."""
+        index = self.rule_indexes.get(phone)
+        if index is not None:
+            return index
+
+        version = self._rule_versions.get(phone, 0)
+        rules = await self.db.get_rules_by_phone(phone)
+        index = RuleIndex(phone, rules)
+        # Only publish if no rule change happened while we were loading
+        if self._rule_versions.get(phone, 0) == version:
+            self.rule_indexes[phone] = index
+        return index
+
+    async def refresh_rules(self, phone: str):
+        """Drop and reload a phone's rule index after its rules changed."""
+        self._rule_versions[phone] = self._rule_versions.get(phone, 0) + 1
+        self.rule_indexes.pop(phone, None)
+        if phone in self.handlers_attached:
+            await self._register_forward_handler(phone)
+
+    async def _register_forward_handler(self, phone: str):
+        """
+        (Re-)register the phone's forward handler filtered to its source chats.
+
+        Telethon drops updates from every other chat before they reach Python.
+        The new filter is fully resolved first, then the old registration is
+        swapped out with no await in between, so no update can slip through.
+        """
+        async with self._get_lock(phone):
+            client = self.clients.get(phone)
+            handler = self.forward_handlers.get(phone)
+            if not client or not handler:
+                return
+
+            index = await self.get_rule_index(phone)
+
+            # Bare IDs: Telethon expands a positive ID to its user/chat/channel forms
+            chats = list(index.by_peer_id)
+            unresolved = []
+            for username in index.by_username:
+                try:
+                    chats.append(await client.get_peer_id(f"@{username}"))
+                except Exception as e:
+                    unresolved.append(username)
+                    log.warning(f"⚠️ [{phone}] Could not resolve source @{username}: {e}")
+
+            builder = None
+            if unresolved:
+                # Fall back to an unfiltered handler rather than silently missing a source
+                builder = events.NewMessage(incoming=True)
+            elif chats:
+                builder = events.NewMessage(incoming=True, chats=chats)
+            if builder is not None:
+                await builder.resolve(client)
+
+            client.remove_event_handler(handler)
+            if builder is not None:
+                client.add_event_handler(handler, builder)
+
+            scope = "all chats" if unresolved else f"{len(chats)} source chats"
+            log.info(f"🔄 [{phone}] Handler registered for {scope} ({len(index)} active rules)")
+
     def _get_session_path(self, user_id: int, phone: str) -> str:
         safe_phone = phone.replace("+", "").replace(" ", "")
         return os.path.join(SESSION_DIR, f"user_{user_id}_{safe_phone}")
@@ -1830,6 +4364,8 @@ class UserSessionManager:
             finally:
                 self.clients.pop(phone, None)
                 self.handlers_attached.discard(phone)
+                self.rule_indexes.pop(phone, None)
+                self.forward_handlers.pop(phone, None)
     
     async def resolve_entity(self, phone: str, identifier: str) -> tuple:
         """Returns (success, entity, error_msg)"""
@@ -1886,6 +4422,26 @@ class UserSessionManager:
         except Exception as e:
             return False, None, str(e)
     
+    async def get_chat_username(self, event) -> Optional[str]:
+        """Username of the event's chat, from the local chat-info cache when possible."""
+        chat_id = event.chat_id
+        username = await self.chat_info_cache.get(chat_id)
+        if username is not None:
+            return username or None
+
+        # Entities shipped with the update avoid a round trip; fetch only if missing
+        chat = event.chat
+        if chat is None:
+            try:
+                chat = await event.get_chat()
+            except Exception as e:
+                log.debug(f"Could not fetch chat {chat_id}: {e}")
+                return None
+
+        username = (getattr(chat, 'username', None) or '').lower()
+        await self.chat_info_cache.set(chat_id, username)
+        return username or None
+
     async def load_existing_sessions(self):
         if not TELETHON_AVAILABLE:
             return
@@ -1930,14 +4486,29 @@ class UserSessionManager:
             return
         
         db_ref = self.db
+        session_ref = self
         phone_ref = phone
         entity_cache = {}
         entity_cache_lock = asyncio.Lock()  # Protect concurrent access to entity_cache
-
-        async def retry_on_timeout(func, *args, max_retries=3, **kwargs):
-            """Retry function on timeout/connection errors."""
+        send_pacer = self.send_pacers.get(phone)
+        if send_pacer is None:
+            send_pacer = self.send_pacers[phone] = SendPacer(
+                Config.ACCOUNT_SEND_RATE, Config.ACCOUNT_SEND_BURST,
+                Config.CHAT_SEND_RATE, Config.GROUP_SENDS_PER_MINUTE
+            )
+        send_methods = (client.send_message, client.send_file, client.forward_messages)
+
+        async def retry_on_timeout(func, *args, max_retries=3, pace_to=None, **kwargs):
+            """
+            Retry function on timeout/connection errors.
+            Sends (or raw requests with pace_to) wait for the account's send pacer first.
+            """
+            if pace_to is None and func in send_methods:
+                pace_to = args[0]
             for attempt in range(max_retries):
                 try:
+                    if pace_to is not None:
+                        await send_pacer.wait(pace_to)
                     return await func(*args, **kwargs)
                 except (OSError, TimeoutError, ConnectionError) as e:
                     error_msg = str(e)
@@ -1953,6 +4524,8 @@ class UserSessionManager:
                         log.error(f"❌ [{phone_ref}] Failed after {max_retries} attempts: {error_msg}")
                         raise
                 except errors.FloodWaitError as e:
+                    if pace_to is not None:
+                        send_pacer.flood(pace_to, e.seconds)
                     if attempt < max_retries - 1:
                         wait_time = e.seconds
                         log.warning(f"⚠️ [{phone_ref}] FloodWait: sleeping {wait_time}s (attempt {attempt + 1}/{max_retries})")
@@ -2019,255 +4592,483 @@ class UserSessionManager:
 
             return entity
         
-        def check_source_match(chat_id: int, chat_username: str, source: str) -> bool:
-            """Check if chat matches a source."""
-            # Username match
-            if source.startswith('@'):
-                src_username = source[1:].lower()
-                return chat_username and chat_username.lower() == src_username
-            
-            # Numeric ID match
+        media_store_ref = self.media_store
+        media_cache_ref = self.media_cache
+        jobs_ref = self.jobs
+
+        def renamed_output_name(temp_name: str, modify: dict) -> str:
+            """8. FILENAME RENAME - New file name if rename is enabled, else temp_name."""
+            rename_pattern = modify.get('rename_pattern', '{original}') if modify.get('rename_enabled', False) else None
+            if rename_pattern and rename_pattern != '{original}':
+                try:
+                    output_name = render_media_filename(temp_name, rename_pattern) or temp_name
+                    log.info(f"[{phone_ref}] Renamed: {temp_name} -> {output_name}")
+                    return output_name
+                except Exception as e:
+                    log.error(f"[{phone_ref}] Rename error: {e}")
+            return temp_name
+
+        async def transform_media(source_file: str, work_dir: str, msg, modify: dict) -> str:
+            """Watermark a downloaded file into work_dir; the source (returned on failure) is left untouched."""
+            output_name = os.path.basename(source_file)
+
+            # 9. WATERMARK - Apply watermark if enabled
+            if modify.get('watermark_enabled', False):
+                try:
+                    # Check if it's an image or video
+                    is_image = msg.photo or (hasattr(msg, 'document') and msg.document and hasattr(msg.document, 'mime_type') and msg.document.mime_type and msg.document.mime_type.startswith('image/'))
+                    is_video = msg.video or (hasattr(msg, 'document') and msg.document and hasattr(msg.document, 'mime_type') and msg.document.mime_type and msg.document.mime_type.startswith('video/'))
+
+                    if is_image or is_video:
+                        # Sanitize basename to prevent path traversal
+                        watermarked_file = os.path.join(work_dir, 'watermarked_' + output_name.replace('..', ''))
+                        media_type = "video" if is_video else "image"
+
+                        log.info(f"🎨 [{phone_ref}] Applying {media_type} watermark to: {source_file}")
+                        log.info(f"🎨 [{phone_ref}] Watermark config: type={modify.get('watermark_type')}, text={modify.get('watermark_text')[:20] if modify.get('watermark_text') else 'None'}...")
+
+                        success = False
+                        if not is_video:
+                            # Images: Pillow in a pool thread (cached fonts/logos/overlays), no FFmpeg fork
+                            success = await session_ref.transform_pool.submit(
+                                apply_watermark_to_image, source_file, watermarked_file, modify
+                            )
+                        if not success:
+                            # Videos (or Pillow unavailable): FFmpeg with the cached overlay when possible
+                            media_file = getattr(msg, 'file', None)
+                            resolution = (getattr(media_file, 'width', None), getattr(media_file, 'height', None))
+                            success = await session_ref.transform_pool.submit(
+                                apply_watermark_with_ffmpeg, source_file, watermarked_file, modify,
+                                is_video=is_video, resolution=resolution
+                            )
+                        log.info(f"🎨 [{phone_ref}] {media_type.capitalize()} watermark result: {'SUCCESS' if success else 'FAILED'}")
+
+                        if success and os.path.exists(watermarked_file):
+                            log.info(f"✅ [{phone_ref}] Watermark applied successfully")
+                            return watermarked_file
+                        if not success:
+                            log.warning(f"⚠️ [{phone_ref}] Watermark failed: watermark function returned False")
+                        else:
+                            log.warning(f"⚠️ [{phone_ref}] Watermark failed: output file not created at {watermarked_file}")
+                        # Clean up failed watermarked file if it exists
+                        try:
+                            if os.path.exists(watermarked_file):
+                                os.remove(watermarked_file)
+                        except (OSError, IOError) as e:
+                            log.warning(f"Failed to cleanup watermarked file {watermarked_file}: {e}")
+
+                except Exception as e:
+                    log.error(f"[{phone_ref}] Watermark error: {e}")
+                    import traceback
+                    log.error(f"[{phone_ref}] Watermark traceback: {traceback.format_exc()}")
+                    # Continue with original file if watermark fails
+
+            return source_file
+
+        def is_streamable_video(msg) -> bool:
+            """Video marked supports_streaming (index up front), so FFmpeg can read it from a pipe."""
+            document = getattr(msg, 'document', None)
+            if not document or not (getattr(document, 'mime_type', None) or '').startswith('video/'):
+                return False
+            return any(
+                isinstance(attr, types.DocumentAttributeVideo) and attr.supports_streaming
+                for attr in getattr(document, 'attributes', [])
+            )
+
+        async def stream_watermark_video(work_dir: str, msg, modify: dict) -> str:
+            """9. WATERMARK a video fed to FFmpeg's stdin from the download (no raw temp copy)."""
+            media_file = msg.file
+            output_name = media_file.name or f"video_{msg.id}{media_file.ext or '.mp4'}"
+            # Sanitize basename to prevent path traversal
+            watermarked_file = os.path.join(work_dir, 'watermarked_' + output_name.replace('..', '').replace(os.sep, '_'))
+
+            log.info(f"🎨 [{phone_ref}] Streaming video watermark: {output_name}")
+            # The download runs inside this job: no overall job timeout, FFmpeg's own
+            # timeout counts from the last chunk received (see run_ffmpeg)
+            success = await session_ref.transform_pool.submit(
+                apply_watermark_with_ffmpeg, None, watermarked_file, modify,
+                is_video=True, resolution=(media_file.width, media_file.height),
+                input_chunks=await media_chunks(msg), timeout=0
+            )
+            if not success or not os.path.exists(watermarked_file):
+                raise RuntimeError("FFmpeg could not watermark the streamed video")
+            log.info(f"✅ [{phone_ref}] Watermark applied successfully (streamed)")
+            return watermarked_file
+
+        def wants_parallel_transfer(msg) -> bool:
+            document = getattr(msg, 'document', None)
+            return bool(document) and Config.PARALLEL_TRANSFER_MIN_MB > 0 \
+                and (getattr(document, 'size', 0) or 0) >= Config.PARALLEL_TRANSFER_MIN_MB * 1024 * 1024
+
+        async def media_chunks(msg):
+            """Ordered download chunks of msg's media - over several connections for large documents."""
+            if wants_parallel_transfer(msg):
+                connections, part_size = await db_ref.get_transfer_settings(phone_ref)
+                return ParallelDownloader(client, msg.document, connections, part_size).iter_chunks()
+            return client.iter_download(msg.media, request_size=512 * 1024)
+
+        async def download_media_file(msg, work_dir: str, progress_callback=None) -> Optional[str]:
+            """Download msg's media into work_dir; large documents in parallel parts."""
+            if wants_parallel_transfer(msg):
+                connections, part_size = await db_ref.get_transfer_settings(phone_ref)
+                name = os.path.basename((msg.file.name or '').replace('..', '')) \
+                    or f"document_{msg.id}{msg.file.ext or ''}"
+                started = time.monotonic()
+                try:
+                    path = await ParallelDownloader(
+                        client, msg.document, connections, part_size, progress_callback
+                    ).download(os.path.join(work_dir, name))
+                    elapsed = max(time.monotonic() - started, 0.001)
+                    log.info(
+                        f"⚡ [{phone_ref}] Parallel download: {msg.file.size / 1048576:.1f} MB in {elapsed:.1f}s "
+                        f"({msg.file.size / 1048576 / elapsed:.1f} MB/s, {connections}x{part_size // 1024} KB)"
+                    )
+                    return path
+                except Exception as e:
+                    log.warning(f"⚠️ [{phone_ref}] Parallel download failed ({e}), using a single connection")
+            return await retry_on_timeout(client.download_media, msg, file=work_dir, progress_callback=progress_callback)
+
+        async def parallel_upload(source, size: int, file_name: str, progress_callback=None):
+            """
+            Upload a large file over several connections and return its InputFile,
+            or None when it is under the threshold (or a path upload failed), in
+            which case send_file/upload_file upload it the usual way.
+            """
+            if Config.PARALLEL_TRANSFER_MIN_MB <= 0 or size < Config.PARALLEL_TRANSFER_MIN_MB * 1024 * 1024:
+                return None
+            connections, part_size = await db_ref.get_transfer_settings(phone_ref)
+            started = time.monotonic()
             try:
-                src_num = int(source)
-                if chat_id == src_num or abs(chat_id) == abs(src_num):
-                    return True
-                # Handle -100 prefix
-                if str(src_num).startswith('-100'):
-                    src_real = int(str(src_num)[4:])
-                    if str(chat_id).startswith('-100'):
-                        chat_real = int(str(chat_id)[4:])
-                        if chat_real == src_real:
-                            return True
-                    if abs(chat_id) == src_real:
-                        return True
-                if str(chat_id).startswith('-100'):
-                    chat_real = int(str(chat_id)[4:])
-                    if chat_real == abs(src_num):
-                        return True
-            except ValueError:
-                pass
-            
-            return False
-        
+                input_file = await ParallelUploader(
+                    client, size, file_name, connections, part_size, progress_callback
+                ).upload(source)
+            except Exception as e:
+                if not isinstance(source, str):
+                    raise  # A stream can't be read twice
+                log.warning(f"⚠️ [{phone_ref}] Parallel upload failed ({e}), using a single connection")
+                return None
+            elapsed = max(time.monotonic() - started, 0.001)
+            log.info(
+                f"⚡ [{phone_ref}] Parallel upload: {size / 1048576:.1f} MB in {elapsed:.1f}s "
+                f"({size / 1048576 / elapsed:.1f} MB/s, {connections} connections)"
+            )
+            return input_file
+
+        async def stream_upload(msg, file_name: str, progress_callback=None):
+            """Upload msg's document while downloading it, through a bounded buffer (no temp file)."""
+            pipe = MediaChunkPipe(
+                await media_chunks(msg),
+                size=msg.file.size,
+                name=file_name,
+                max_chunks=Config.STREAM_BUFFER_CHUNKS
+            )
+            try:
+                return await parallel_upload(pipe, msg.file.size, file_name, progress_callback) \
+                    or await client.upload_file(
+                        pipe, file_size=msg.file.size, file_name=file_name, progress_callback=progress_callback
+                    )
+            finally:
+                await pipe.aclose()
+
+        async def prepare_media(media_scope: MessageMediaScope, msg, downloader, transform_key: str = '',
+                                modify: dict = None) -> Optional[str]:
+            """
+            Local file for msg's media, downloaded once per message via
+            `await downloader(work_dir)` and watermarked once per watermark key
+            (RulePlan.watermark_key), whatever the destination or rename.
+            """
+            base_key = (phone_ref, msg.chat_id, msg.id, '')
+            # Reserved in the spool before anything is written
+            expected_size = getattr(msg.file, 'size', 0) or 0
+            cache_key = media_cache_key(msg)
+            variant = MediaFileCache.variant_name(transform_key)
+            watermarked = bool(transform_key) and modify.get('watermark_enabled', False)
+
+            # CACHE: The same media watermarked the same way earlier (any chat or rule)
+            if watermarked and media_cache_ref.contains(cache_key, variant):
+                async def produce_cached(work_dir):
+                    return await media_cache_ref.fetch(cache_key, variant, work_dir)
+
+                cached_file = await media_scope.get((phone_ref, msg.chat_id, msg.id, transform_key, 'cache'), produce_cached)
+                if cached_file:
+                    log.info(f"💾 [{phone_ref}] Media cache hit: {cache_key} (watermarked)")
+                    return cached_file
+
+            # STREAMING: Watermark streamable videos straight from the download, unless
+            # the raw file is already on disk for this message
+            if watermarked and Config.MEDIA_STREAMING and is_streamable_video(msg) \
+                    and not media_scope.store.is_ready(base_key) and not media_cache_ref.contains(cache_key):
+                async def produce_streamed(work_dir):
+                    path = await stream_watermark_video(work_dir, msg, modify)
+                    await media_cache_ref.store(cache_key, variant, path)
+                    return path
+
+                try:
+                    return await media_scope.get(
+                        (phone_ref, msg.chat_id, msg.id, transform_key, 'stream'), produce_streamed, expected_size
+                    )
+                except Exception as e:
+                    log.warning(f"⚠️ [{phone_ref}] Streaming watermark failed ({e}), using a temp file")
+
+            async def download_cached(work_dir):
+                # CACHE: Consulted before downloading; fresh downloads are added to it
+                path = await media_cache_ref.fetch(cache_key, 'original', work_dir)
+                if path:
+                    log.info(f"💾 [{phone_ref}] Media cache hit: {cache_key}")
+                    return path
+                path = await downloader(work_dir)
+                if path:
+                    await media_cache_ref.store(cache_key, 'original', path)
+                return path
+
+            source_file = await media_scope.get(base_key, download_cached, expected_size)
+            if not source_file or not transform_key:
+                return source_file
+
+            async def produce(work_dir):
+                path = await transform_media(source_file, work_dir, msg, modify)
+                # Only a successful watermark is worth caching (a rename is the cached original)
+                if watermarked and path and os.path.basename(path).startswith('watermarked_'):
+                    await media_cache_ref.store(cache_key, variant, path)
+                return path
+
+            return await media_scope.get((phone_ref, msg.chat_id, msg.id, transform_key), produce, expected_size)
+
+        # Per-account cap on destinations being delivered to at once (all messages/albums)
+        fanout_slots = asyncio.Semaphore(max(1, Config.FANOUT_CONCURRENCY))
+
+        async def fan_out(deliver, destinations) -> int:
+            """Run `await deliver(dest)` for every destination concurrently; returns how many delivered."""
+            async def bounded(dest):
+                async with fanout_slots:
+                    return await deliver(dest)
+
+            results = await asyncio.gather(*(bounded(dest) for dest in destinations))
+            return sum(1 for delivered in results if delivered)
+
+        async def fan_out_jobs(deliver, destinations, rule_id: int, chat_id: int, message_ids: list,
+                               job: dict = None) -> int:
+            """
+            fan_out with each destination journaled in outbound_jobs until delivered.
+            A resumed `job` is delivered to its own destination only.
+            """
+            if job is not None:
+                destinations = [job['destination']]
+                job_ids = {job['destination']: job['id']}
+            else:
+                job_ids = await jobs_ref.record(phone_ref, rule_id, chat_id, message_ids, destinations)
+
+            results = {}
+
+            async def journaled(dest):
+                delivered = await deliver(dest)
+                if job is not None:
+                    job['delivered'] = delivered  # the queue worker finishes or defers it
+                elif dest in job_ids:
+                    results[job_ids[dest]] = delivered
+                return delivered
+
+            try:
+                return await fan_out(journaled, destinations)
+            finally:
+                # One write for the whole fan-out
+                if results:
+                    await jobs_ref.finish(results)
+
+        # Plain forwards arriving together go out as one forward_messages call per destination
+        forward_batcher = ForwardBatcher(
+            lambda dest_entity, messages: retry_on_timeout(client.forward_messages, dest_entity, messages),
+            Config.FORWARD_BATCH_WINDOW, label=phone, slots=fanout_slots
+        )
+
+        async def forward_without_author(dest_entity, messages: list, drop_captions: bool = False):
+            """Server-side copy: forward hiding the original author (and optionally media captions)."""
+            import random
+
+            from_peer = await messages[0].get_input_chat()
+            to_peer = await client.get_input_entity(dest_entity)
+            return await retry_on_timeout(client, functions.messages.ForwardMessagesRequest(
+                from_peer=from_peer,
+                id=[m.id for m in messages],
+                to_peer=to_peer,
+                random_id=[random.randrange(-2**63, 2**63) for _ in messages],
+                drop_author=True,
+                drop_media_captions=drop_captions or None
+            ), pace_to=dest_entity)
+
         # Album handling - use manager for automatic cleanup
         album_cache_manager_ref = self.album_cache_manager
 
-        async def send_album_group(grouped_id: int):
-            """Send collected album messages as a group."""
-            album_data = await album_cache_manager_ref.pop(grouped_id)
+        async def send_album_group(grouped_id: int, album_data: dict = None, job: dict = None):
+            """Send collected album messages as a group (`album_data`/`job` when resuming a job)."""
+            if album_data is None:
+                album_data = await album_cache_manager_ref.pop(grouped_id)
             if not album_data:
                 return
 
             messages = album_data['messages']
-            dest_list = album_data['dest_list']
-            rule = album_data['rule']
-            original_caption = album_data.get('caption_text', '')
-            filters = album_data.get('filters', {})
-            modify = album_data.get('modify', {})
-            forward_mode = rule.get('forward_mode', 'forward')
+            plan = album_data['plan']
+            dest_list = plan.dest_list
+            modify = plan.modify
 
             if not messages:
                 return
 
             log.info(f"📚 [{phone_ref}] Sending album with {len(messages)} items")
 
-            # Apply caption cleaning to album caption
-            caption_text = original_caption
-
-            # Apply caption cleaning filters
-            if filters.get('clean_caption', False):
-                caption_text = ""
-            elif caption_text:
-                # Apply specific cleaners (using pre-compiled regex patterns)
-                if filters.get('clean_hashtag', False):
-                    caption_text = REGEX_HASHTAG.sub('', caption_text)
-                if filters.get('clean_mention', False):
-                    caption_text = REGEX_MENTION.sub('', caption_text)
-                if filters.get('clean_link', False):
-                    caption_text = REGEX_URL_LEGACY.sub('', caption_text)
-                if filters.get('clean_emoji', False):
-                    caption_text = REGEX_EMOJI.sub('', caption_text)
-                if filters.get('clean_phone', False):
-                    caption_text = REGEX_PHONE_BASIC.sub('', caption_text)
-                if filters.get('clean_email', False):
-                    caption_text = REGEX_EMAIL_STRICT.sub('', caption_text)
-
-                # Clean up whitespace (using pre-compiled patterns)
-                caption_text = REGEX_WHITESPACE_MULTI.sub(' ', caption_text)
-                caption_text = REGEX_LINE_TRIM.sub('', caption_text)
-                caption_text = REGEX_NEWLINE_MULTI.sub('\n\n', caption_text)
-                caption_text = caption_text.strip()
-
-            # Apply modify features
-            # Track if we should use entities
-            caption_entities = None
-
-            # Apply custom caption if enabled (replaces original caption)
-            if modify.get('caption_enabled', False):
-                custom_caption = modify.get('caption_text', '')
-                if custom_caption:
-                    caption_text = custom_caption
-                    # Get pre-parsed entities for custom caption (deserialize from storage)
-                    caption_entities = deserialize_entities(modify.get('caption_entities', []))
-
-            if modify.get('header_enabled', False):
-                header = modify.get('header_text', '')
-                if header:
-                    caption_text = f"{header}\n{caption_text}" if caption_text else header
-                    # Clear entities if modifying after custom caption
-                    caption_entities = None
-
-            if modify.get('footer_enabled', False):
-                footer = modify.get('footer_text', '')
-                if footer:
-                    caption_text = f"{caption_text}\n{footer}" if caption_text else footer
-                    # Clear entities if modifying after custom caption
-                    caption_entities = None
-
-            # Check if caption cleaning or modification is active
-            caption_cleaning_active = any([
-                filters.get('clean_caption', False),
-                filters.get('clean_hashtag', False),
-                filters.get('clean_mention', False),
-                filters.get('clean_link', False),
-                filters.get('clean_emoji', False),
-                filters.get('clean_phone', False),
-                filters.get('clean_email', False)
-            ])
-            modify_caption_active = any([
-                modify.get('header_enabled', False),
-                modify.get('footer_enabled', False),
-                modify.get('caption_enabled', False),
-                modify.get('replace_enabled', False),
-                modify.get('watermark_enabled', False),  # Watermark requires copy mode
-                modify.get('apply_spoiler', False)  # Spoiler effect requires copy mode
-            ])
+            # Compiled caption pipeline: cleaners, custom caption, header, footer
+            caption_text, caption_entities = plan.album_caption(album_data.get('caption_text', ''))
+            use_copy_mode = plan.use_copy_mode
 
-            # Use copy mode if explicitly selected OR if caption/content modification is needed
-            use_copy_mode = (forward_mode == "copy") or caption_cleaning_active or modify_caption_active
+            media_scope = MessageMediaScope(media_store_ref)
 
-            for dest in dest_list:
+            async def download_album():
+                """Download (and watermark) every item once for all destinations; None on failure."""
+                album_files = []
                 try:
-                    dest_entity = await resolve_dest(dest)
-                    if dest_entity is None:
-                        log.error(f"❌ [{phone_ref}] Could not resolve: {dest}")
-                        continue
-
-                    if use_copy_mode:
-                        # COPY MODE: Download and re-upload as album
-                        import tempfile
-                        import os as temp_os
-
-                        # Download all media files
-                        files = []
-                        for msg in messages:
-                            temp_file = await retry_on_timeout(
-                                client.download_media,
-                                msg,
-                                file=tempfile.gettempdir()
-                            )
-                            if temp_file:
-                                # Apply watermark if enabled
-                                if modify.get('watermark_enabled', False):
-                                    try:
-                                        is_image = msg.photo or (hasattr(msg, 'document') and msg.document and hasattr(msg.document, 'mime_type') and msg.document.mime_type and msg.document.mime_type.startswith('image/'))
-                                        is_video = msg.video or (hasattr(msg, 'document') and msg.document and hasattr(msg.document, 'mime_type') and msg.document.mime_type and msg.document.mime_type.startswith('video/'))
-
-                                        if is_image or is_video:
-                                            original_file = temp_file
-                                            # Sanitize basename to prevent path traversal
-                                            safe_basename = temp_os.path.basename(temp_file).replace('..', '')
-                                            watermarked_file = temp_os.path.join(
-                                                temp_os.path.dirname(temp_file),
-                                                'watermarked_' + safe_basename
-                                            )
-
-                                            success = False
-                                            media_type = "video" if is_video else "image"
-                                            log.info(f"🎨 [{phone_ref}] Album: Applying {media_type} watermark...")
-
-                                            # Use FFmpeg for watermarking (works for both images and videos)
-                                            success = apply_watermark_with_ffmpeg(temp_file, watermarked_file, modify, is_video=is_video)
+                    for msg in messages:
+                        async def download_item(work_dir, msg=msg):
+                            return await download_media_file(msg, work_dir)
+
+                        temp_file = await prepare_media(
+                            media_scope, msg, download_item,
+                            plan.watermark_key, modify
+                        )
+                        if temp_file:
+                            album_files.append(temp_file)
+                except Exception as e:
+                    log.error(f"❌ [{phone_ref}] Album download failed: {e}")
+                    return None
+                return album_files
 
-                                            if success and temp_os.path.exists(watermarked_file):
-                                                try:
-                                                    temp_os.remove(original_file)
-                                                except (OSError, IOError) as e:
-                                                    log.warning(f"Failed to cleanup original file {original_file}: {e}")
-                                                temp_file = watermarked_file
-                                    except Exception as e:
-                                        log.error(f"[{phone_ref}] Album watermark error: {e}")
+            try:
+                files = None  # downloaded only when the bytes must be uploaded
+                # ZERO-TRANSFER COPY: Without a watermark the items are re-sent by reference
+                reference_album = None
+                if use_copy_mode and not plan.watermark_key \
+                        and not any(getattr(m, 'noforwards', False) for m in messages):
+                    reference_album = [reference_input_media(m.media, plan.apply_spoiler) for m in messages]
+                    if not all(media is not None for media in reference_album):
+                        reference_album = None
+
+                async def deliver_album(dest) -> bool:
+                    """Send the album to one destination; True if it was delivered."""
+                    nonlocal files, reference_album
+                    try:
+                        dest_entity = await resolve_dest(dest)
+                        if dest_entity is None:
+                            log.error(f"❌ [{phone_ref}] Could not resolve: {dest}")
+                            return False
+
+                        if use_copy_mode:
+                            # Send as album (first file gets caption with entities)
+                            send_kwargs = {}
+                            if caption_text:
+                                send_kwargs['caption'] = caption_text
+                                if caption_entities:
+                                    send_kwargs['formatting_entities'] = caption_entities
+
+                            # FAST PATH: Nothing to change but the caption removal - forward without author
+                            if plan.forward_without_author:
+                                try:
+                                    await forward_without_author(dest_entity, messages, drop_captions=plan.remove_caption)
+                                    log.info(f"✅ [{phone_ref}] ALBUM copied without author ({len(messages)} items) -> {dest}")
+                                    return True
+                                except Exception as e:
+                                    log.warning(f"⚠️ [{phone_ref}] Album forward without author failed ({e}), copying instead")
 
-                                files.append(temp_file)
+                            if reference_album is not None:
+                                try:
+                                    await retry_on_timeout(client.send_file, dest_entity, reference_album, **send_kwargs)
+                                    log.info(f"📚 [{phone_ref}] ALBUM ({len(reference_album)} items, by reference) -> {dest}")
+                                    return True
+                                except Exception as e:
+                                    log.warning(f"⚠️ [{phone_ref}] Album re-send by reference failed ({e}), downloading instead")
+                                    reference_album = None
 
-                        if files:
-                            try:
-                                # Send as album (first file gets caption with entities)
-                                send_kwargs = {}
-                                if caption_text:
-                                    send_kwargs['caption'] = caption_text
-                                    if caption_entities:
-                                        send_kwargs['formatting_entities'] = caption_entities
+                            if files is None:
+                                files = await download_album()
+                                if files is None:
+                                    return False
 
+                            # COPY MODE: Re-upload the shared files as album
+                            if files:
                                 # Apply spoiler effect if enabled (pass as list for albums)
-                                if modify.get('apply_spoiler', False):
+                                if plan.apply_spoiler:
                                     send_kwargs['spoiler'] = [True] * len(files)
 
-                                await retry_on_timeout(
-                                    client.send_file,
-                                    dest_entity,
-                                    files,
-                                    **send_kwargs
-                                )
-                                log.info(f"📚 [{phone_ref}] ALBUM ({len(files)} files) -> {dest}")
-                            finally:
-                                # Clean up temp files
-                                for f in files:
+                                # Upload once: later destinations re-send the first album by reference
+                                album_key = tuple(files)
+                                async with media_scope.first_upload(album_key):
+                                    uploaded = media_scope.uploads.get(album_key)
                                     try:
-                                        if f and temp_os.path.exists(f):
-                                            temp_os.remove(f)
-                                    except Exception:
-                                        pass
-                    else:
-                        # FORWARD MODE: Forward all messages together
-                        await client.forward_messages(entity=dest_entity, messages=messages)
-                        log.info(f"✅ [{phone_ref}] ALBUM forwarded ({len(messages)} items) -> {dest}")
+                                        sent = await retry_on_timeout(
+                                            client.send_file,
+                                            dest_entity,
+                                            [reference_input_media(media, plan.apply_spoiler) or media for media in uploaded]
+                                            if uploaded is not None else files,
+                                            **send_kwargs
+                                        )
+                                    except Exception as e:
+                                        if uploaded is None:
+                                            raise
+                                        log.warning(f"⚠️ [{phone_ref}] Album re-send by reference failed ({e}), uploading again")
+                                        media_scope.uploads.pop(album_key, None)
+                                        uploaded = None
+                                        sent = await retry_on_timeout(client.send_file, dest_entity, files, **send_kwargs)
+                                    if uploaded is None and isinstance(sent, list) and len(sent) == len(files) \
+                                            and all(getattr(m, 'media', None) is not None for m in sent):
+                                        media_scope.uploads[album_key] = [m.media for m in sent]
+                                log.info(f"📚 [{phone_ref}] ALBUM ({len(files)} files) -> {dest}")
+                                return True
+                            return False
+                        else:
+                            # FORWARD MODE: Forward all messages together
+                            await retry_on_timeout(client.forward_messages, dest_entity, messages)
+                            log.info(f"✅ [{phone_ref}] ALBUM forwarded ({len(messages)} items) -> {dest}")
+                            return True
 
-                except Exception as e:
-                    log.error(f"❌ [{phone_ref}] Album send failed: {e}")
+                    except Exception as e:
+                        log.error(f"❌ [{phone_ref}] Album send failed: {e}")
+                        return False
+
+                await fan_out_jobs(
+                    deliver_album, dest_list, plan.rule_id, messages[0].chat_id,
+                    [m.id for m in messages], job
+                )
+            finally:
+                # Last reference deletes the shared temp files
+                media_scope.close()
         
-        @client.on(events.NewMessage(incoming=True))
-        async def forward_handler(event):
+        async def forward_handler(event, scheduled_rule_id: int = None, job: dict = None):
+            # Media downloaded for this message, shared by all its rules and destinations
+            media_scope = MessageMediaScope(media_store_ref)
             try:
                 chat_id = event.chat_id
-                chat = await event.get_chat()
-                chat_username = getattr(chat, 'username', None)
-                
-                rules = await db_ref.get_rules_by_phone(phone_ref)
-                if not rules:
+                rule_index = await session_ref.get_rule_index(phone_ref)
+                if not rule_index.rules:
+                    return
+
+                # Match on chat_id; only @username sources need the chat's username
+                chat_username = None
+                if rule_index.by_username:
+                    chat_username = await session_ref.get_chat_username(event)
+
+                # One hash lookup resolves the chat to the rules sourcing from it
+                plans = rule_index.match(chat_id, chat_username)
+                if not plans:
                     return
                 
-                for rule in rules:
-                    source_list = rule.get('source_list', [])
-                    dest_list = rule.get('dest_list', [])
-                    rule_id = rule['id']
-                    forward_mode = rule.get('forward_mode', 'forward')
-                    filters = rule.get('filters', {})
-                    modify = rule.get('modify', {})
-
-                    # Check if message matches ANY source
-                    is_match = False
-                    matched_source = None
-                    
-                    for src in source_list:
-                        if check_source_match(chat_id, chat_username, src):
-                            is_match = True
-                            matched_source = src
-                            break
-                    
-                    if not is_match:
+                for plan in plans:
+                    # A released delayed post only goes out for the rule that scheduled it
+                    if scheduled_rule_id is not None and plan.rule_id != scheduled_rule_id:
                         continue
-                    
+                    dest_list = plan.dest_list
+                    rule_id = plan.rule_id
+                    forward_mode = plan.forward_mode
+                    filters = plan.filters
+                    modify = plan.modify
+
                     # ========== FILTER CHECK ==========
                     msg = event.message
                     
@@ -2324,11 +5125,8 @@ class UserSessionManager:
                             # First message of album - start collecting
                             await album_cache_manager_ref.set(grouped_id, {
                                 'messages': [msg],
-                                'dest_list': dest_list,
-                                'rule': rule,
+                                'plan': plan,
                                 'caption_text': msg.message or msg.text or "",
-                                'filters': filters,
-                                'modify': modify,
                             })
                             # Schedule sending after 1.5 seconds
                             loop = asyncio.get_running_loop()
@@ -2388,76 +5186,10 @@ class UserSessionManager:
                     # Get original text/caption
                     original_text = msg.message or msg.text or ""
                     original_entities = msg.entities  # Capture original formatting entities
-                    filtered_text = original_text
-                    removed_items = []
-                    
-                    # 0. CAPTION REMOVE - Remove entire caption
-                    if filters.get('clean_caption', False):
-                        if original_text:
-                            filtered_text = ""
-                            removed_items.append('entire caption')
-                    
-                    # 1. HASHTAG CLEANER - Remove all #hashtags (pre-compiled pattern)
-                    if filters.get('clean_hashtag', False) and filtered_text:
-                        before = filtered_text
-                        filtered_text = REGEX_HASHTAG.sub('', filtered_text)
-                        if before != filtered_text:
-                            removed_items.append('#hashtags')
-
-                    # 2. MENTION CLEANER - Remove all @mentions (pre-compiled pattern)
-                    if filters.get('clean_mention', False):
-                        before = filtered_text
-                        filtered_text = REGEX_MENTION.sub('', filtered_text)
-                        if before != filtered_text:
-                            removed_items.append('@mentions')
-
-                    # 3. LINK CLEANER - Remove URLs from text (pre-compiled patterns)
-                    if filters.get('clean_link', False):
-                        before = filtered_text
-                        # Remove various URL formats using pre-compiled patterns
-                        filtered_text = REGEX_URL_HTTPS.sub('', filtered_text)
-                        filtered_text = REGEX_URL_HTTP.sub('', filtered_text)
-                        filtered_text = REGEX_URL_WWW.sub('', filtered_text)
-                        filtered_text = REGEX_URL_TG_ME.sub('', filtered_text)
-                        filtered_text = REGEX_URL_TG_SCHEME.sub('', filtered_text)
-                        if before != filtered_text:
-                            removed_items.append('links')
-                    
-                    # 4. EMOJI CLEANER - Remove all emojis from text (pre-compiled pattern)
-                    if filters.get('clean_emoji', False):
-                        before = filtered_text
-                        filtered_text = REGEX_EMOJI.sub('', filtered_text)
-                        if before != filtered_text:
-                            removed_items.append('emojis')
-
-                    # 5. PHONE CLEANER - Remove phone numbers (pre-compiled patterns)
-                    if filters.get('clean_phone', False):
-                        before = filtered_text
-                        # Match various phone formats using pre-compiled patterns
-                        filtered_text = REGEX_PHONE_FORMATTED.sub('', filtered_text)
-                        filtered_text = REGEX_PHONE_SIMPLE.sub('', filtered_text)
-                        if before != filtered_text:
-                            removed_items.append('phones')
-
-                    # 6. EMAIL CLEANER - Remove email addresses (pre-compiled pattern)
-                    if filters.get('clean_email', False):
-                        before = filtered_text
-                        filtered_text = REGEX_EMAIL.sub('', filtered_text)
-                        if before != filtered_text:
-                            removed_items.append('emails')
-
-                    # Clean up the filtered text (pre-compiled patterns)
-                    filtered_text = REGEX_WHITESPACE_MULTI.sub(' ', filtered_text)  # multiple spaces
-                    filtered_text = REGEX_LINE_TRIM.sub('', filtered_text)  # line trim
-                    filtered_text = REGEX_NEWLINE_MULTI.sub('\n\n', filtered_text)  # multiple newlines
-                    filtered_text = filtered_text.strip()
-                    
-                    # Store for copy mode
-                    caption_text = filtered_text
-                    caption_entities = None  # Entities invalid after text modification
-                    
+                    filtered_text, removed_items = plan.clean_caption(original_text)
+
                     # Link preview removal
-                    remove_link_preview = filters.get('clean_link', False)
+                    remove_link_preview = plan.remove_link_preview
                     
                     log.info(f"[{phone_ref}] MATCH rule {rule_id}: {msg_type}, mode={forward_mode}")
                     if removed_items:
@@ -2467,124 +5199,44 @@ class UserSessionManager:
 
                     # ========== MODIFY CONTENT FEATURES ==========
 
-                    # 1. BLOCK WORDS - Skip message if contains blocked words
-                    if modify.get('block_words_enabled', False):
-                        block_words = modify.get('block_words', [])
-                        if block_words and caption_text:
-                            text_lower = caption_text.lower()
-                            should_skip = False
-                            for word in block_words:
-                                if word.lower() in text_lower:
-                                    log.info(f"[{phone_ref}] SKIPPED: Contains blocked word '{word}'")
-                                    should_skip = True
-                                    break  # Stop checking more words
-                            if should_skip:
-                                continue  # Skip to next rule
-
-                    # 2. WHITELIST WORDS - Skip message if NOT contains whitelist words
-                    if modify.get('whitelist_enabled', False):
-                        whitelist_words = modify.get('whitelist_words', [])
-                        if whitelist_words and caption_text:
-                            text_lower = caption_text.lower()
-                            has_whitelist = any(word.lower() in text_lower for word in whitelist_words)
-                            if not has_whitelist:
-                                log.info(f"[{phone_ref}] SKIPPED: Does not contain any whitelist word")
-                                continue  # Skip to next rule
-
-                    # 3. WORD REPLACEMENT - Replace words/phrases in text
-                    # Note: User-defined regex patterns are cached for performance
-                    if modify.get('replace_enabled', False):
-                        replace_pairs = modify.get('replace_pairs', [])
-                        if replace_pairs and caption_text:
-                            # Cache for user-defined regex patterns (prevents recompilation)
-                            if not hasattr(forward_handler, '_user_regex_cache'):
-                                forward_handler._user_regex_cache = {}
-
-                            for pair in replace_pairs:
-                                old = pair.get('from', '')
-                                new = pair.get('to', '')
-                                use_regex = pair.get('regex', False)
-                                if old:
-                                    if use_regex:
-                                        try:
-                                            # Use cached compiled pattern if available
-                                            if old not in forward_handler._user_regex_cache:
-                                                forward_handler._user_regex_cache[old] = re.compile(old)
-                                            pattern = forward_handler._user_regex_cache[old]
-                                            caption_text = pattern.sub(new, caption_text)
-                                        except Exception as e:
-                                            log.error(f"[{phone_ref}] Regex replace error: {e}")
-                                    else:
-                                        caption_text = caption_text.replace(old, new)
-
-                    # 4. CUSTOM CAPTION - Replace original caption with custom caption
-                    # Store caption entities for formatted captions
-                    custom_caption_entities = None
-                    if modify.get('caption_enabled', False):
-                        custom_caption = modify.get('caption_text', '')
-                        if custom_caption:
-                            caption_text = custom_caption
-                            # Get pre-parsed entities for custom caption (deserialize from storage)
-                            custom_caption_entities = deserialize_entities(modify.get('caption_entities', []))
-                            # Clear original entities since we're replacing caption
-                            caption_entities = custom_caption_entities
-
-                    # 5. HEADER TEXT - Add text to beginning
-                    if modify.get('header_enabled', False):
-                        header = modify.get('header_text', '')
-                        if header:
-                            caption_text = f"{header}\n{caption_text}" if caption_text else header
-                            # Clear entities if modifying after custom caption
-                            if custom_caption_entities:
-                                caption_entities = None
-
-                    # 6. FOOTER TEXT - Add text to end
-                    if modify.get('footer_enabled', False):
-                        footer = modify.get('footer_text', '')
-                        if footer:
-                            caption_text = f"{caption_text}\n{footer}" if caption_text else footer
-                            # Clear entities if modifying after custom caption
-                            if custom_caption_entities:
-                                caption_entities = None
+                    # 1-2. BLOCK / WHITELIST WORDS - Skip message based on cleaned caption
+                    skip_reason = plan.blocked_reason(filtered_text)
+                    if skip_reason:
+                        log.info(f"[{phone_ref}] SKIPPED: {skip_reason}")
+                        continue  # Skip to next rule
+
+                    # 3-6. REPLACE, CUSTOM CAPTION, HEADER, FOOTER (entities only survive a bare custom caption)
+                    caption_text, caption_entities = plan.finish_caption(filtered_text)
 
                     # 7. DELAY - Wait before forwarding
-                    if modify.get('delay_enabled', False):
-                        delay_seconds = modify.get('delay_seconds', 0)
-                        if delay_seconds > 0:
-                            log.info(f"[{phone_ref}] Delaying {delay_seconds}s before forwarding...")
-                            await asyncio.sleep(delay_seconds)
-
-                    # 7. LINK BUTTONS - Prepare custom button markup
-                    button_markup = None
-                    if modify.get('buttons_enabled', False) and types:
-                        buttons_data = modify.get('buttons', [])
-                        if buttons_data:
-                            try:
-                                # Build button rows (Telethon requires KeyboardButtonRow objects)
-                                button_rows = []
-                                for row in buttons_data:
-                                    if isinstance(row, list):
-                                        btn_row = []
-                                        for btn in row:
-                                            if isinstance(btn, dict) and 'text' in btn and 'url' in btn:
-                                                btn_row.append(types.KeyboardButtonUrl(btn['text'], btn['url']))
-                                        if btn_row:
-                                            # Wrap each row in KeyboardButtonRow
-                                            button_rows.append(types.KeyboardButtonRow(btn_row))
-                                if button_rows:
-                                    button_markup = types.ReplyInlineMarkup(button_rows)
-                                    log.info(f"[{phone_ref}] Added {len(button_rows)} button row(s)")
-                            except Exception as e:
-                                log.error(f"[{phone_ref}] Button creation error: {e}")
-
-                    # Forward/Copy to ALL destinations
-                    success_count = 0
-                    for dest in dest_list:
+                    if plan.delay_seconds > 0 and scheduled_rule_id is None:
+                        # DELAY: Persisted as a scheduled delivery; the handler doesn't wait for it
+                        if await session_ref.scheduler.schedule(phone_ref, rule_id, chat_id, msg.id, plan.delay_seconds):
+                            log.info(f"⏰ [{phone_ref}] Scheduled in {plan.delay_seconds}s (rule {rule_id})")
+                        continue
+
+                    # 7. LINK BUTTONS - Prebuilt when the rule was compiled
+                    button_markup = plan.button_markup
+
+                    # 8. FILENAME RENAME - Rendered once per message and rule ({random}, {time}, ...), so
+                    # every destination and upload path below uses (and reuses uploads under) the same name
+                    rename_name = None
+                    if plan.use_copy_mode and msg.file is not None and modify.get('rename_enabled', False) \
+                            and modify.get('rename_pattern', '{original}') != '{original}':
+                        rename_name = renamed_output_name(
+                            msg.file.name or f"{extract_media_attributes(msg)[0] or 'document'}_{msg.id}{msg.file.ext or ''}",
+                            modify
+                        )
+
+                    # Forward/Copy to ALL destinations (concurrently, see fan_out)
+                    async def deliver(dest) -> Optional[bool]:
+                        """Send the message to one destination; True if delivered, None if already sent."""
+                        delivered = False
                         try:
                             dest_entity = await resolve_dest(dest)
                             if dest_entity is None:
                                 log.error(f"❌ [{phone_ref}] Could not resolve: {dest}")
-                                continue
+                                return delivered
 
                             # Get destination chat ID for deduplication
                             dest_chat_id = dest_entity.id if hasattr(dest_entity, 'id') else 0
@@ -2620,32 +5272,33 @@ class UserSessionManager:
                                 )
                                 if is_duplicate:
                                     log.info(f"⏭️ [{phone_ref}] SKIPPED DUPLICATE: {file_name_for_cache or 'file'} already sent to {dest}")
-                                    continue  # Skip this destination
-
-                            # Check if any caption cleaning is enabled
-                            # If caption cleaning is active, force copy mode to apply the changes
-                            caption_cleaning_active = any([
-                                filters.get('clean_caption', False),
-                                filters.get('clean_hashtag', False),
-                                filters.get('clean_mention', False),
-                                filters.get('clean_link', False),
-                                filters.get('clean_emoji', False),
-                                filters.get('clean_phone', False),
-                                filters.get('clean_email', False)
-                            ])
-
-                            # Also check if modify features that affect caption or media are enabled
-                            modify_caption_active = any([
-                                modify.get('header_enabled', False),
-                                modify.get('footer_enabled', False),
-                                modify.get('caption_enabled', False),
-                                modify.get('replace_enabled', False),
-                                modify.get('watermark_enabled', False),  # Watermark requires copy mode
-                                modify.get('apply_spoiler', False)  # Spoiler effect requires copy mode
-                            ])
-
-                            # Use copy mode if explicitly selected OR if caption/content modification is needed
-                            use_copy_mode = (forward_mode == "copy") or caption_cleaning_active or modify_caption_active
+                                    return None  # Skip this destination
+
+                            # Copy mode is explicit or forced by caption/content modification (precomputed)
+                            use_copy_mode = plan.use_copy_mode
+
+                            # FAST PATH: Copy with nothing to change but the caption removal - forward
+                            # without author (text-only messages have no media caption to drop)
+                            if use_copy_mode and plan.forward_without_author and (
+                                not plan.remove_caption or (msg.media is not None and msg.web_preview is None)
+                            ):
+                                try:
+                                    await forward_without_author(dest_entity, [msg], drop_captions=plan.remove_caption)
+                                    delivered = True
+                                    log.info(f"✅ [{phone_ref}] Copied without author -> {dest}")
+                                    if file_unique_id and file_id_for_cache:
+                                        await db_ref.mark_file_processed(
+                                            file_id_for_cache,
+                                            str(file_unique_id),
+                                            rule_id,
+                                            chat_id,
+                                            dest_chat_id,
+                                            getattr(msg.file, 'size', 0) or 0,
+                                            file_name_for_cache
+                                        )
+                                    return delivered
+                                except Exception as e:
+                                    log.warning(f"⚠️ [{phone_ref}] Forward without author failed ({e}), copying instead")
 
                             if use_copy_mode:
                                 # COPY MODE: Download & re-upload with filtered caption
@@ -2674,18 +5327,18 @@ class UserSessionManager:
                                         
                                         if is_only_web_preview:
                                             # TEXT with hidden link + preview card
-                                            await client.send_message(
+                                            await retry_on_timeout(
+                                                client.send_message,
                                                 dest_entity,
                                                 caption_text,
                                                 formatting_entities=caption_entities if caption_entities else None,
                                                 link_preview=not remove_link_preview,  # Remove preview if link filter ON
                                                 buttons=button_markup
                                             )
-                                            success_count += 1
+                                            delivered = True
                                             log.info(f"🔗 [{phone_ref}] TEXT+PREVIEW -> {dest}")
                                         else:
                                             # HAS REAL MEDIA - Download and re-send with filtered caption
-                                            import tempfile
                                             import os as temp_os
 
                                             # Get file size for progress tracking
@@ -2722,175 +5375,34 @@ class UserSessionManager:
                                                         last_percentage[0] = percentage
                                                         log.info(f"📥 [{phone_ref}] Downloading: {percentage}% ({format_bytes(current)}/{format_bytes(total)})")
 
-                                            # Download to temp file with progress tracking
-                                            if file_size > 10 * 1024 * 1024:  # Log for files > 10MB
-                                                log.info(f"📥 [{phone_ref}] Starting download: {format_bytes(file_size)}")
-
-                                            temp_file = await retry_on_timeout(
-                                                client.download_media,
-                                                msg,
-                                                file=tempfile.gettempdir(),
-                                                progress_callback=download_progress if file_size > 10 * 1024 * 1024 else None
-                                            )
-
-                                            # 8. FILENAME RENAME - Rename file if enabled
-                                            if temp_file and modify.get('rename_enabled', False):
-                                                rename_pattern = modify.get('rename_pattern', '{original}')
-                                                if rename_pattern and rename_pattern != '{original}':
-                                                    try:
-                                                        import random
-                                                        from datetime import datetime
-
-                                                        # Get original filename
-                                                        original_name = temp_os.path.basename(temp_file)
-                                                        name_parts = temp_os.path.splitext(original_name)
-                                                        original_base = name_parts[0]
-                                                        extension = name_parts[1]
-
-                                                        # Apply pattern replacements
-                                                        new_name = rename_pattern
-                                                        new_name = new_name.replace('{original}', original_base)
-                                                        new_name = new_name.replace('{date}', datetime.now().strftime('%Y%m%d'))
-                                                        new_name = new_name.replace('{time}', datetime.now().strftime('%H%M%S'))
-                                                        new_name = new_name.replace('{random}', str(random.randint(1000, 9999)))
-                                                        # Note: {counter} would need persistent storage, using random for now
-                                                        new_name = new_name.replace('{counter}', str(random.randint(1, 999)))
-
-                                                        # Add extension
-                                                        new_filename = new_name + extension
-
-                                                        # Sanitize filename - remove invalid characters for Windows/Unix
-                                                        invalid_chars = '<>:"/\\|?*\n\r\t'
-                                                        for char in invalid_chars:
-                                                            new_filename = new_filename.replace(char, '_')
-                                                        # Remove multiple underscores and spaces (pre-compiled pattern)
-                                                        new_filename = REGEX_FILENAME_SPACES.sub('_', new_filename)
-                                                        new_filename = new_filename.strip('_')
-
-                                                        new_path = temp_os.path.join(temp_os.path.dirname(temp_file), new_filename)
-
-                                                        # Rename file
-                                                        temp_os.rename(temp_file, new_path)
-                                                        temp_file = new_path
-                                                        log.info(f"[{phone_ref}] Renamed: {original_name} -> {new_filename}")
-                                                    except Exception as e:
-                                                        log.error(f"[{phone_ref}] Rename error: {e}")
-
-                                            # 9. WATERMARK - Apply watermark if enabled
-                                            if temp_file and modify.get('watermark_enabled', False):
-                                                try:
-                                                    # Check if it's an image or video
-                                                    is_image = msg.photo or (hasattr(msg, 'document') and msg.document and hasattr(msg.document, 'mime_type') and msg.document.mime_type and msg.document.mime_type.startswith('image/'))
-                                                    is_video = msg.video or (hasattr(msg, 'document') and msg.document and hasattr(msg.document, 'mime_type') and msg.document.mime_type and msg.document.mime_type.startswith('video/'))
-
-                                                    if is_image or is_video:
-                                                        import os as wm_os
-                                                        original_file = temp_file
-                                                        # Sanitize basename to prevent path traversal
-                                                        safe_basename = temp_os.path.basename(temp_file).replace('..', '')
-                                                        watermarked_file = temp_os.path.join(
-                                                            temp_os.path.dirname(temp_file),
-                                                            'watermarked_' + safe_basename
-                                                        )
-
-                                                        # Apply appropriate watermark
-                                                        success = False
-                                                        media_type = "video" if is_video else "image"
-
-                                                        log.info(f"🎨 [{phone_ref}] Applying {media_type} watermark to: {temp_file}")
-                                                        log.info(f"🎨 [{phone_ref}] Watermark config: type={modify.get('watermark_type')}, text={modify.get('watermark_text')[:20] if modify.get('watermark_text') else 'None'}...")
-
-                                                        # Use FFmpeg for watermarking (works for both images and videos)
-                                                        log.info(f"🎨 [{phone_ref}] Applying FFmpeg watermark...")
-                                                        success = apply_watermark_with_ffmpeg(temp_file, watermarked_file, modify, is_video=is_video)
-
-                                                        log.info(f"🎨 [{phone_ref}] {media_type.capitalize()} watermark result: {'SUCCESS' if success else 'FAILED'}")
-
-                                                        if success and wm_os.path.exists(watermarked_file):
-                                                            # Delete original and use watermarked version
-                                                            try:
-                                                                wm_os.remove(original_file)
-                                                            except (OSError, IOError) as e:
-                                                                log.warning(f"Failed to cleanup original file {original_file}: {e}")
-                                                            temp_file = watermarked_file
-                                                            log.info(f"✅ [{phone_ref}] Watermark applied successfully")
-                                                        else:
-                                                            if not success:
-                                                                log.warning(f"⚠️ [{phone_ref}] Watermark failed: watermark function returned False")
-                                                            elif not wm_os.path.exists(watermarked_file):
-                                                                log.warning(f"⚠️ [{phone_ref}] Watermark failed: output file not created at {watermarked_file}")
-                                                            else:
-                                                                log.warning(f"⚠️ [{phone_ref}] Watermark failed, sending original")
-                                                            # Clean up failed watermarked file if it exists
-                                                            try:
-                                                                if wm_os.path.exists(watermarked_file):
-                                                                    wm_os.remove(watermarked_file)
-                                                            except (OSError, IOError) as e:
-                                                                log.warning(f"Failed to cleanup watermarked file {watermarked_file}: {e}")
-
-                                                except Exception as e:
-                                                    log.error(f"[{phone_ref}] Watermark error: {e}")
-                                                    import traceback
-                                                    log.error(f"[{phone_ref}] Watermark traceback: {traceback.format_exc()}")
-                                                    # Continue with original file if watermark fails
-
-                                            if temp_file is None:
-                                                log.error(f"❌ [{phone_ref}] Download failed")
-                                                if caption_text:
-                                                    await client.send_message(
-                                                        dest_entity,
-                                                        caption_text,
-                                                        formatting_entities=caption_entities if caption_entities else None,
-                                                        link_preview=has_web_preview,
-                                                        buttons=button_markup
-                                                    )
-                                                continue
-                                            
-                                            try:
-                                                # Progress callback for uploads
-                                                upload_last_percentage = [0]
-                                                def upload_progress(current, total):
-                                                    if total > 0:
-                                                        percentage = int((current / total) * 100)
-                                                        # Log every 10% progress for large files (>10MB)
-                                                        if total > 10 * 1024 * 1024 and percentage >= upload_last_percentage[0] + 10:
-                                                            upload_last_percentage[0] = percentage
-                                                            log.info(f"📤 [{phone_ref}] Uploading: {percentage}% ({format_bytes(current)}/{format_bytes(total)})")
-
-                                                # Get file size for upload progress
-                                                upload_file_size = 0
-                                                if temp_file and temp_os.path.exists(temp_file):
-                                                    upload_file_size = temp_os.path.getsize(temp_file)
-                                                    if upload_file_size > 10 * 1024 * 1024:  # Log for files > 10MB
-                                                        log.info(f"📤 [{phone_ref}] Starting upload: {format_bytes(upload_file_size)}")
-
-                                                # Common send parameters for filtered caption
-                                                caption_kwargs = {}
-                                                if caption_text:
-                                                    caption_kwargs['caption'] = caption_text
-                                                    if caption_entities:
-                                                        caption_kwargs['formatting_entities'] = caption_entities
-                                                # Add buttons if enabled
-                                                if button_markup:
-                                                    caption_kwargs['buttons'] = button_markup
-                                                # Add progress callback for large files
-                                                if upload_file_size > 10 * 1024 * 1024:
-                                                    caption_kwargs['progress_callback'] = upload_progress
-                                                # Apply spoiler effect if enabled
-                                                if modify.get('apply_spoiler', False):
-                                                    caption_kwargs['spoiler'] = True
-
-                                                # Extract media attributes for format preservation
-                                                media_type, media_attrs, media_mime, media_thumb = extract_media_attributes(msg)
-
+                                            # Common send parameters for filtered caption
+                                            caption_kwargs = {}
+                                            if caption_text:
+                                                caption_kwargs['caption'] = caption_text
+                                                if caption_entities:
+                                                    caption_kwargs['formatting_entities'] = caption_entities
+                                            # Add buttons if enabled
+                                            if button_markup:
+                                                caption_kwargs['buttons'] = button_markup
+                                            # Apply spoiler effect if enabled
+                                            if plan.apply_spoiler:
+                                                caption_kwargs['spoiler'] = True
+
+                                            # Extract media attributes for format preservation
+                                            media_type, media_attrs, media_mime, media_thumb = extract_media_attributes(msg)
+
+                                            async def send_media(media_source, file_name: str = None):
+                                                """Send the media in its original format; media_source is a path or an uploaded reference."""
+                                                sent = None
+                                                attrs = with_file_name(media_attrs, file_name) if file_name and not msg.photo else media_attrs
                                                 # PHOTO with caption
                                                 if msg.photo:
-                                                    await retry_on_timeout(
+                                                    sent = await retry_on_timeout(
                                                         client.send_file,
                                                         dest_entity,
-                                                        temp_file,
+                                                        media_source,
                                                         force_document=False,  # Keep as photo
-                                                        attributes=media_attrs if media_attrs else None,
+                                                        attributes=attrs if attrs else None,
                                                         thumb=media_thumb,
                                                         **caption_kwargs
                                                     )
@@ -2898,29 +5410,30 @@ class UserSessionManager:
                                                 
                                                 # VIDEO NOTE (round video - no caption)
                                                 elif msg.video_note:
-                                                    await retry_on_timeout(
+                                                    sent = await retry_on_timeout(
                                                         client.send_file,
                                                         dest_entity,
-                                                        temp_file,
+                                                        media_source,
                                                         video_note=True,
-                                                        attributes=media_attrs if media_attrs else None,
+                                                        attributes=attrs if attrs else None,
                                                         mime_type=media_mime
                                                     )
                                                     log.info(f"⭕ [{phone_ref}] VIDEO_NOTE -> {dest}")
                                                 
                                                 # VOICE MESSAGE
                                                 elif msg.voice:
-                                                    await retry_on_timeout(
+                                                    sent = await retry_on_timeout(
                                                         client.send_file,
                                                         dest_entity,
-                                                        temp_file,
+                                                        media_source,
                                                         voice_note=True,
-                                                        attributes=media_attrs if media_attrs else None,
+                                                        attributes=attrs if attrs else None,
                                                         mime_type=media_mime
                                                     )
                                                     # Voice doesn't support caption, send separately
                                                     if original_text:
-                                                        await client.send_message(
+                                                        await retry_on_timeout(
+                                                            client.send_message,
                                                             dest_entity,
                                                             original_text,
                                                             formatting_entities=original_entities,
@@ -2931,13 +5444,13 @@ class UserSessionManager:
                                                 
                                                 # VIDEO with caption
                                                 elif msg.video:
-                                                    await retry_on_timeout(
+                                                    sent = await retry_on_timeout(
                                                         client.send_file,
                                                         dest_entity,
-                                                        temp_file,
+                                                        media_source,
                                                         supports_streaming=True,
                                                         force_document=False,  # Keep as video, not document
-                                                        attributes=media_attrs if media_attrs else None,
+                                                        attributes=attrs if attrs else None,
                                                         mime_type=media_mime,
                                                         thumb=media_thumb,
                                                         **caption_kwargs
@@ -2946,12 +5459,12 @@ class UserSessionManager:
 
                                                 # GIF / Animation with caption
                                                 elif msg.gif:
-                                                    await retry_on_timeout(
+                                                    sent = await retry_on_timeout(
                                                         client.send_file,
                                                         dest_entity,
-                                                        temp_file,
+                                                        media_source,
                                                         force_document=False,
-                                                        attributes=media_attrs if media_attrs else None,
+                                                        attributes=attrs if attrs else None,
                                                         mime_type=media_mime,
                                                         thumb=media_thumb,
                                                         **caption_kwargs
@@ -2960,24 +5473,24 @@ class UserSessionManager:
 
                                                 # STICKER (no caption)
                                                 elif msg.sticker:
-                                                    await retry_on_timeout(
+                                                    sent = await retry_on_timeout(
                                                         client.send_file,
                                                         dest_entity,
-                                                        temp_file,
+                                                        media_source,
                                                         force_document=False,
-                                                        attributes=media_attrs if media_attrs else None,
+                                                        attributes=attrs if attrs else None,
                                                         mime_type=media_mime
                                                     )
                                                     log.info(f"🎨 [{phone_ref}] STICKER -> {dest}")
                                                 
                                                 # AUDIO (music) with caption
                                                 elif msg.audio:
-                                                    await retry_on_timeout(
+                                                    sent = await retry_on_timeout(
                                                         client.send_file,
                                                         dest_entity,
-                                                        temp_file,
+                                                        media_source,
                                                         force_document=False,
-                                                        attributes=media_attrs if media_attrs else None,
+                                                        attributes=attrs if attrs else None,
                                                         mime_type=media_mime,
                                                         thumb=media_thumb,
                                                         **caption_kwargs
@@ -2986,12 +5499,12 @@ class UserSessionManager:
 
                                                 # DOCUMENT (file) with caption
                                                 elif msg.document:
-                                                    await retry_on_timeout(
+                                                    sent = await retry_on_timeout(
                                                         client.send_file,
                                                         dest_entity,
-                                                        temp_file,
+                                                        media_source,
                                                         force_document=True,
-                                                        attributes=media_attrs if media_attrs else None,
+                                                        attributes=attrs if attrs else None,
                                                         mime_type=media_mime,
                                                         thumb=media_thumb,
                                                         **caption_kwargs
@@ -3000,19 +5513,19 @@ class UserSessionManager:
 
                                                 # OTHER MEDIA with caption
                                                 else:
-                                                    await retry_on_timeout(
+                                                    sent = await retry_on_timeout(
                                                         client.send_file,
                                                         dest_entity,
-                                                        temp_file,
-                                                        attributes=media_attrs if media_attrs else None,
+                                                        media_source,
+                                                        attributes=attrs if attrs else None,
                                                         mime_type=media_mime,
                                                         thumb=media_thumb,
                                                         **caption_kwargs
                                                     )
                                                     log.info(f"📎 [{phone_ref}] MEDIA -> {dest}")
+                                                return sent
 
-                                                success_count += 1
-
+                                            async def mark_processed(size):
                                                 # Mark file as processed to prevent duplicates
                                                 if file_unique_id and file_id_for_cache:
                                                     await db_ref.mark_file_processed(
@@ -3021,29 +5534,184 @@ class UserSessionManager:
                                                         rule_id,
                                                         chat_id,
                                                         dest_chat_id,
-                                                        upload_file_size,
+                                                        size,
                                                         file_name_for_cache
                                                     )
 
-                                            finally:
-                                                # Clean up temp file
+                                            # Progress callback for uploads
+                                            upload_last_percentage = [0]
+                                            def upload_progress(current, total):
+                                                if total > 0:
+                                                    percentage = int((current / total) * 100)
+                                                    # Log every 10% progress for large files (>10MB)
+                                                    if total > 10 * 1024 * 1024 and percentage >= upload_last_percentage[0] + 10:
+                                                        upload_last_percentage[0] = percentage
+                                                        log.info(f"📤 [{phone_ref}] Uploading: {percentage}% ({format_bytes(current)}/{format_bytes(total)})")
+
+                                            # 8. FILENAME RENAME (rename_name, rendered above) is applied as the
+                                            # document's filename attribute, so it holds whatever path the bytes take
+
+                                            # ZERO-TRANSFER COPY: No rename/watermark means the bytes don't change - re-send
+                                            # the original photo/document by reference with the new caption/spoiler/buttons
+                                            sent = None
+                                            if not plan.media_transform_key and not getattr(msg, 'noforwards', False):
+                                                reference_media = reference_input_media(msg.media, plan.apply_spoiler)
+                                                if reference_media is not None:
+                                                    try:
+                                                        sent = await send_media(reference_media)
+                                                    except Exception as e:
+                                                        log.warning(f"⚠️ [{phone_ref}] Re-send by reference failed ({e}), downloading instead")
+
+                                            # IN-MEMORY COPY: Small media (most photos, stickers, voice notes) is downloaded
+                                            # into a buffer once per message and uploaded from it - no temp file syscalls
+                                            if sent is None and file_size and file_size <= Config.MEMORY_MEDIA_MAX_KB * 1024 \
+                                                    and not modify.get('watermark_enabled', False):
+                                                memory_key = ('memory', plan.media_transform_key, rename_name)
+                                                async with media_scope.first_upload(memory_key):
+                                                    uploaded = media_scope.uploads.get(memory_key)
+                                                    try:
+                                                        if uploaded is not None:
+                                                            sent = await send_media(reference_input_media(uploaded, plan.apply_spoiler) or uploaded)
+                                                        else:
+                                                            memory_name = msg.file.name or f"{media_type or 'document'}_{msg.id}{msg.file.ext or ''}"
+
+                                                            async def read_small_media():
+                                                                # CACHE: Consulted before downloading; fresh downloads are added to it
+                                                                cached = media_cache_ref.path(media_cache_key(msg))
+                                                                if cached:
+                                                                    with open(cached, 'rb') as f:
+                                                                        return f.read()
+                                                                data = await retry_on_timeout(client.download_media, msg, file=bytes)
+                                                                if data:
+                                                                    await media_cache_ref.store(media_cache_key(msg), 'original', data=data, file_name=memory_name)
+                                                                return data
+
+                                                            data = await media_scope.get_bytes((phone_ref, msg.chat_id, msg.id), read_small_media)
+                                                            if data:
+                                                                # The upload name only drives Telethon's type detection (photo vs document)
+                                                                input_file = await client.upload_file(data, file_name=rename_name or memory_name)
+                                                                sent = await send_media(input_file, file_name=rename_name)
+                                                                if getattr(sent, 'media', None) is not None:
+                                                                    media_scope.uploads[memory_key] = sent.media
+                                                    except Exception as e:
+                                                        log.warning(f"⚠️ [{phone_ref}] In-memory copy failed ({e}), using a temp file")
+                                                        media_scope.uploads.pop(memory_key, None)
+                                                        sent = None
+
+                                            # STREAMING COPY: Rename-only documents go from the download straight into the
+                                            # upload through a bounded buffer - no temp file, first byte sent before the last arrives
+                                            if sent is None and Config.MEDIA_STREAMING and file_size and msg.document \
+                                                    and plan.media_transform_key and not modify.get('watermark_enabled', False) \
+                                                    and not media_cache_ref.contains(media_cache_key(msg)):
+                                                stream_key = ('stream', plan.media_transform_key, rename_name)
+                                                async with media_scope.first_upload(stream_key):
+                                                    uploaded = media_scope.uploads.get(stream_key)
+                                                    try:
+                                                        if uploaded is not None:
+                                                            sent = await send_media(reference_input_media(uploaded, plan.apply_spoiler) or uploaded)
+                                                        else:
+                                                            stream_name = rename_name or msg.file.name or f"document_{msg.id}{msg.file.ext or ''}"
+                                                            if file_size > 10 * 1024 * 1024:
+                                                                log.info(f"🔀 [{phone_ref}] Streaming copy: {format_bytes(file_size)}")
+                                                            input_file = await stream_upload(
+                                                                msg, stream_name,
+                                                                progress_callback=upload_progress if file_size > 10 * 1024 * 1024 else None
+                                                            )
+                                                            sent = await send_media(input_file, file_name=rename_name)
+                                                            if getattr(sent, 'media', None) is not None:
+                                                                media_scope.uploads[stream_key] = sent.media
+                                                    except Exception as e:
+                                                        log.warning(f"⚠️ [{phone_ref}] Streaming copy failed ({e}), using a temp file")
+                                                        media_scope.uploads.pop(stream_key, None)
+                                                        sent = None
+
+                                            if sent is not None:
+                                                delivered = True
+                                                await mark_processed(file_size)
+                                                return delivered
+
+                                            async def download_to(work_dir):
+                                                # Download to temp file with progress tracking
+                                                if file_size > 10 * 1024 * 1024:  # Log for files > 10MB
+                                                    log.info(f"📥 [{phone_ref}] Starting download: {format_bytes(file_size)}")
+                                                return await download_media_file(
+                                                    msg,
+                                                    work_dir,
+                                                    progress_callback=download_progress if file_size > 10 * 1024 * 1024 else None
+                                                )
+
+                                            # 9. WATERMARK - Downloaded and watermarked once per message, shared with
+                                            # other destinations and rules using the same watermark settings
+                                            temp_file = await prepare_media(
+                                                media_scope, msg, download_to, plan.watermark_key, modify
+                                            )
+
+                                            if temp_file is None:
+                                                log.error(f"❌ [{phone_ref}] Download failed")
+                                                if caption_text:
+                                                    await retry_on_timeout(
+                                                        client.send_message,
+                                                        dest_entity,
+                                                        caption_text,
+                                                        formatting_entities=caption_entities if caption_entities else None,
+                                                        link_preview=has_web_preview,
+                                                        buttons=button_markup
+                                                    )
+                                                return delivered
+
+                                            # Upload once: later destinations re-send the first upload by reference.
+                                            # Keyed by the name too: a re-sent reference keeps its original filename
+                                            upload_key = (temp_file, rename_name)
+                                            async with media_scope.first_upload(upload_key):
+                                                uploaded = media_scope.uploads.get(upload_key)
+
+                                                # Get file size for upload progress
+                                                upload_file_size = 0
+                                                if temp_file and temp_os.path.exists(temp_file):
+                                                    upload_file_size = temp_os.path.getsize(temp_file)
+                                                    if upload_file_size > 10 * 1024 * 1024 and uploaded is None:  # Log for files > 10MB
+                                                        log.info(f"📤 [{phone_ref}] Starting upload: {format_bytes(upload_file_size)}")
+                                                # Add progress callback for large files
+                                                if upload_file_size > 10 * 1024 * 1024:
+                                                    caption_kwargs['progress_callback'] = upload_progress
+
+                                                async def upload_source():
+                                                    # Large files are uploaded in parallel parts first; send_file then just attaches the handle
+                                                    return await parallel_upload(
+                                                        temp_file, upload_file_size, os.path.basename(temp_file), upload_progress
+                                                    ) or temp_file
+
                                                 try:
-                                                    if temp_file and temp_os.path.exists(temp_file):
-                                                        temp_os.remove(temp_file)
-                                                except Exception:
-                                                    pass
+                                                    sent = await send_media(
+                                                        (reference_input_media(uploaded, plan.apply_spoiler) or uploaded)
+                                                        if uploaded is not None else await upload_source(),
+                                                        file_name=rename_name
+                                                    )
+                                                except Exception as e:
+                                                    if uploaded is None:
+                                                        raise
+                                                    log.warning(f"⚠️ [{phone_ref}] Re-send by reference failed ({e}), uploading again")
+                                                    media_scope.uploads.pop(upload_key, None)
+                                                    uploaded = None
+                                                    sent = await send_media(await upload_source(), file_name=rename_name)
+                                                if uploaded is None and getattr(sent, 'media', None) is not None:
+                                                    media_scope.uploads[upload_key] = sent.media
+
+                                            delivered = True
+                                            await mark_processed(upload_file_size)
                                     
                                     else:
                                         # TEXT ONLY MESSAGE (no media, may have link preview)
                                         if caption_text:
-                                            await client.send_message(
+                                            await retry_on_timeout(
+                                                client.send_message,
                                                 dest_entity,
                                                 caption_text,
                                                 formatting_entities=caption_entities if caption_entities else None,
                                                 link_preview=not remove_link_preview,  # Remove preview if link filter ON
                                                 buttons=button_markup
                                             )
-                                            success_count += 1
+                                            delivered = True
                                             log.info(f"💬 [{phone_ref}] TEXT -> {dest}")
                                 
                                 except Exception as copy_err:
@@ -3052,9 +5720,10 @@ class UserSessionManager:
                                     traceback.print_exc()
                                 
                             else:
-                                # FORWARD MODE: Keep original sender + forward header
-                                await client.forward_messages(entity=dest_entity, messages=event.message)
-                                success_count += 1
+                                # FORWARD MODE: Keep original sender + forward header (batched with
+                                # other forwards from this chat to this destination, see ForwardBatcher)
+                                await forward_batcher.forward((rule_id, chat_id, dest_chat_id), dest_entity, event.message)
+                                delivered = True
                                 log.info(f"✅ [{phone_ref}] Forwarded -> {dest}")
 
                                 # Mark file as processed to prevent duplicates
@@ -3065,19 +5734,44 @@ class UserSessionManager:
                                         rule_id,
                                         chat_id,
                                         dest_chat_id,
-                                        file_size,
+                                        getattr(msg.file, 'size', 0) or 0,
                                         file_name_for_cache
                                     )
 
                         except Exception as e:
                             log.error(f"❌ [{phone_ref}] {forward_mode} to {dest} failed: {e}")
-                    
+                        return delivered
+
+                    success_count = await fan_out_jobs(deliver, dest_list, rule_id, chat_id, [msg.id], job)
                     if success_count > 0:
                         await db_ref.increment_forward_count(rule_id)
                         
             except Exception as e:
                 log.exception(f"Handler error: {e}")
+            finally:
+                # Last reference deletes the shared temp files
+                media_scope.close()
         
+        async def run_job(job: dict, messages: list):
+            """Deliver a resumed outbound job: a single message, or an album's items."""
+            if messages[0].grouped_id:
+                rule_index = await session_ref.get_rule_index(phone_ref)
+                plan = next((p for p in rule_index.plans if p.rule_id == job['rule_id']), None)
+                if plan is None:
+                    return
+                caption = next((m.message for m in reversed(messages) if m.message), "")
+                await send_album_group(
+                    messages[0].grouped_id,
+                    album_data={'messages': messages, 'plan': plan, 'caption_text': caption},
+                    job=job
+                )
+            else:
+                await forward_handler(ScheduledMessageEvent(messages[0]), scheduled_rule_id=job['rule_id'], job=job)
+
+        # Subscribe only to the rules' source chats (also warms the rule index)
+        self.forward_handlers[phone] = forward_handler
+        self.job_runners[phone] = run_job
+        await self._register_forward_handler(phone)
         self.handlers_attached.add(phone)
         log.info(f"✅ Handler attached for {phone}")
     
@@ -3086,6 +5780,9 @@ class UserSessionManager:
         if self._album_cache_started:
             await self.album_cache_manager.stop()
             self._album_cache_started = False
+        await self.scheduler.stop()
+        await self.jobs.stop()
+        await self.transform_pool.stop()
         # Disconnect all clients
         for phone in list(self.clients.keys()):
             await self.disconnect_client(phone)
@@ -3200,9 +5897,85 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         rules = await db.get_user_rules(user.id)
         count = len([r for r in rules if r['phone'] == phone and r['is_enabled']])
         text += f"{status} {phone} ({count} rules)\n"
+        pacer = session_manager.send_pacers.get(phone)
+        if pacer and pacer.floods:
+            pacing = pacer.stats()
+            text += (
+                f"   🚦 {pacing['floods']} FloodWaits, pacing sends at "
+                f"{pacing['rate']:.2f}/s (configured {pacing['base_rate']:.2f}/s)\n"
+            )
+
+    pool = session_manager.transform_pool.stats()
+    if pool['submitted']:
+        text += (
+            f"\n🎨 Watermark queue: {pool['queue_depth']} waiting, {pool['running']}/{pool['workers']} running\n"
+            f"⏱️ Wait: avg {pool['avg_wait']:.1f}s, max {pool['max_wait']:.1f}s"
+            f" | ✅ {pool['completed']} ❌ {pool['failed']} ⌛ {pool['timed_out']}\n"
+        )
+
+    if len(session_manager.scheduler):
+        text += f"\n⏰ Scheduled posts pending: {len(session_manager.scheduler)}\n"
+
+    jobs = await db.count_outbound_jobs()
+    if jobs:
+        text += (
+            f"📮 Outbound jobs: {jobs.get('running', 0)} running, {jobs.get('pending', 0)} pending,"
+            f" {jobs.get('failed', 0)} failed\n"
+        )
+
+    cache = session_manager.media_cache.stats()
+    if cache['hits'] or cache['misses']:
+        text += (
+            f"\n🗄️ Media cache: {cache['entries']} files, {cache['bytes'] / 1048576:.0f}/{cache['max_bytes'] / 1048576:.0f} MB"
+            f" | hits {cache['hits']}, misses {cache['misses']}, evicted {cache['evictions']}\n"
+        )
+
+    spool = session_manager.spool.stats()
+    if spool['admitted']:
+        text += (
+            f"\n💾 Spool: {spool['reserved'] / 1048576:.0f}/{spool['quota'] / 1048576:.0f} MB, "
+            f"{spool['jobs']} jobs, {spool['waiting']} waiting for space\n"
+            f"⏱️ Waited {spool['waited']}x (max {spool['max_wait']:.1f}s), rejected {spool['rejected']}"
+            f" | peak {spool['peak'] / 1048576:.0f} MB\n"
+        )
     
     await update.message.reply_text(text)
 
+async def cmd_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show or set per-account parallel transfer settings: /transfer <phone> <connections> <part_kb>|default"""
+    user = update.effective_user
+    args = context.args or []
+
+    if len(args) >= 2:
+        phone = args[0]
+        if args[1].lower() == 'default':
+            connections, part_kb = None, None
+        else:
+            try:
+                connections = int(args[1])
+                part_kb = int(args[2]) if len(args) > 2 else None
+            except ValueError:
+                await update.message.reply_text("❌ Usage: /transfer <phone> <connections> [part_kb] | default")
+                return
+            # Snapped to valid values; an omitted part size stays NULL (follows the Config default)
+            connections, part_size = normalize_transfer_settings(connections, part_kb)
+            part_kb = part_size // 1024 if part_kb is not None else None
+        if not await db.set_transfer_settings(user.id, phone, connections, part_kb):
+            await update.message.reply_text(f"❌ Account {phone} not found.")
+            return
+
+    accounts = await db.get_user_accounts(user.id)
+    if not accounts:
+        await update.message.reply_text("📊 No accounts connected.")
+        return
+
+    text = "⚡ Parallel transfers (large files):\n\n"
+    for acc in accounts:
+        connections, part_size = await db.get_transfer_settings(acc['phone'])
+        text += f"📱 {acc['phone']}: {connections} connections × {part_size // 1024} KB parts\n"
+    text += f"\nFiles from {Config.PARALLEL_TRANSFER_MIN_MB} MB. Change: /transfer <phone> <connections> <part_kb>"
+    await update.message.reply_text(text)
+
 async def cmd_rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     rules = await db.get_user_rules(user.id)
@@ -3229,6 +6002,7 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /start - Menu
 /status - Account status  
 /rules - Your rules
+/transfer - Large file transfer settings
 /help - This help
 
 *How to use:*
@@ -5954,8 +8728,6 @@ async def handle_watermark_logo_message(update, context, user, state):
         # Convert to PNG using FFmpeg (works for all media types)
         # This ensures animated stickers/GIFs are converted to static PNG
         try:
-            import subprocess
-
             log.info(f"🎬 Converting logo to static PNG using FFmpeg...")
 
             # Use FFmpeg to extract first frame and save as PNG
@@ -5972,7 +8744,7 @@ async def handle_watermark_logo_message(update, context, user, state):
             ]
 
             log.info(f"🎬 FFmpeg command: {' '.join(ffmpeg_cmd)}")
-            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True, timeout=30)
+            result = await run_ffmpeg(ffmpeg_cmd, timeout=30)
 
             if result.returncode == 0:
                 log.info(f"✅ Logo converted to PNG successfully")
@@ -6144,8 +8916,19 @@ async def on_startup(app):
     await db.ensure_initialized()
     session_manager = UserSessionManager(db)
 
+    # Anything left in the spool belongs to a previous run
+    removed = session_manager.spool.sweep()
+    if removed:
+        log.info(f"🧹 Swept {removed} leftover entries from spool {Config.SPOOL_DIR}")
+
     if TELETHON_AVAILABLE:
+        # Before any handler is attached: only the previous run's 'running' jobs are interrupted ones
+        await session_manager.jobs.recover()
         await session_manager.load_existing_sessions()
+        # After the sessions, so overdue delayed posts find their accounts connected
+        await session_manager.scheduler.start()
+        # Same for deliveries interrupted by the last shutdown
+        await session_manager.jobs.start()
 
         # Update health metrics
         if health_server_instance:
@@ -6230,6 +9013,7 @@ def main():
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("status", cmd_status))
     app.add_handler(CommandHandler("rules", cmd_rules))
+    app.add_handler(CommandHandler("transfer", cmd_transfer))
     app.add_handler(CommandHandler("help", cmd_help))
     app.add_handler(CallbackQueryHandler(callback_handler))
     # Accept text messages, photos, stickers, animations (GIFs), and documents